@@ -0,0 +1,62 @@
+# admins.py
+# Per-chat administrator sets, fetched once with get_chat_administrators and
+# kept fresh by a TTL plus chat_member updates (promote/demote).
+
+import time
+import asyncio
+
+from cache import LRUCache
+
+ADMIN_STATUSES = ("administrator", "creator")
+
+
+class AdminCache:
+    def __init__(self, ttl=600, maxsize=5000):
+        self.ttl = ttl
+        self._chats = LRUCache(maxsize)  # chat_id -> (expires_at, set of user ids)
+        self._inflight = {}              # chat_id -> asyncio.Task
+        self.fetches = 0
+
+    async def admins(self, bot, chat_id):
+        entry = self._chats.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        task = self._inflight.get(chat_id)
+        # concurrent lookups for the same chat share one fetch
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._fetch(bot, chat_id))
+            self._inflight[chat_id] = task
+            task.add_done_callback(lambda t: self._done(chat_id, t))
+        return await asyncio.shield(task)
+
+    def _done(self, chat_id, task):
+        if self._inflight.get(chat_id) is task:
+            del self._inflight[chat_id]
+
+    async def _fetch(self, bot, chat_id):
+        self.fetches += 1
+        members = await bot.get_chat_administrators(chat_id)
+        ids = {m.user.id for m in members}
+        self._chats.put(chat_id, (time.monotonic() + self.ttl, ids))
+        return ids
+
+    async def is_admin(self, bot, chat_id, user_id):
+        return user_id in await self.admins(bot, chat_id)
+
+    def apply_member_update(self, chat_id, user_id, status):
+        """Apply a chat_member status change to the cached set, if any."""
+        entry = self._chats.peek(chat_id)
+        if entry is None:
+            return
+        if status in ADMIN_STATUSES:
+            entry[1].add(user_id)
+        else:
+            entry[1].discard(user_id)
+
+    def invalidate(self, chat_id):
+        self._chats.pop(chat_id)
+
+    def stats(self):
+        out = self._chats.stats()
+        out["fetches"] = self.fetches
+        return out
@@ -4,18 +4,42 @@
 # Features: webhook receiver, sticker ban, /q, /kang, moderation, /info, /all, pin/purge/lock, notes, welcome, antilink, flood-control
 
 import os
+import atexit
+import asyncio
 import io
 import time
-import sqlite3
 import logging
-import asyncio
 from pathlib import Path
-from flask import Flask, request
-from PIL import Image, ImageDraw, ImageFont
-
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, ChatPermissions
+from flask import Flask, request, Response
+
+from storage import Storage, WriteBehind
+from cache import LRUCache
+from admins import AdminCache
+from ingest import UpdateIngestor, QueueFull
+from flood import FloodControl
+from sticker_index import StickerIndex
+from convert import ConversionService, ConversionBusy
+from sticker_cache import StickerCache, BlobStore, RENDER_VERSION, PROFILE_NAMES
+import media
+from msgindex import MessageIndex
+from ratelimit import PriorityRateLimiter
+from notices import NoticeAggregator
+from note_index import NoteIndex
+import linkfilter
+from linkfilter import FilterEngine
+import metrics
+import tracing
+from state import open_state
+from shard import ShardRouter
+from dedup import UpdateDedup
+from roster import MentionPages, chunk_mentions
+from packs import PackRegistry, pack_name, pack_title
+from media import MediaRejected
+
+from telegram.error import BadRequest
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputSticker, ChatPermissions
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
+    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler,
     ContextTypes, filters
 )
 
@@ -23,7 +47,41 @@ from telegram.ext import (
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 # Render provides a public url in RENDER_EXTERNAL_URL env var usually. You may set WEBHOOK_URL manually if needed.
 PUBLIC_URL = os.environ.get("RENDER_EXTERNAL_URL") or os.environ.get("WEBHOOK_URL") or ""
+# Bot API server; point at a local Bot API server or a stub (benchmarks/replay.py)
+API_BASE = os.environ.get("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+# Telegram user id allowed to run operator commands (/profile)
+OWNER_ID = int(os.environ.get("OWNER_ID", "0"))
 DB_PATH = Path("bot_data.db")
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "2"))
+# member tracking is buffered and flushed in batches
+MEMBER_FLUSH_INTERVAL = float(os.environ.get("MEMBER_FLUSH_INTERVAL", "1.0"))
+MEMBER_FLUSH_SIZE = int(os.environ.get("MEMBER_FLUSH_SIZE", "500"))
+# last_seen is stored at this granularity (seconds) so repeat sightings coalesce;
+# members not seen for MEMBER_RETENTION_DAYS are pruned every MEMBER_PRUNE_INTERVAL
+MEMBER_SEEN_RESOLUTION = int(os.environ.get("MEMBER_SEEN_RESOLUTION", "300"))
+MEMBER_RETENTION_DAYS = float(os.environ.get("MEMBER_RETENTION_DAYS", "90"))
+MEMBER_PRUNE_INTERVAL = float(os.environ.get("MEMBER_PRUNE_INTERVAL", "3600"))
+# /all: members seen in the last ALL_ACTIVE_DAYS (at most ALL_MAX_MEMBERS), ALL_PAGE_MENTIONS
+# per message; pages are cached per chat for ALL_PAGE_TTL and sent ALL_CONCURRENCY at a time
+ALL_ACTIVE_DAYS = float(os.environ.get("ALL_ACTIVE_DAYS", "30"))
+ALL_MAX_MEMBERS = int(os.environ.get("ALL_MAX_MEMBERS", "5000"))
+ALL_PAGE_MENTIONS = int(os.environ.get("ALL_PAGE_MENTIONS", "50"))
+ALL_PAGE_TTL = float(os.environ.get("ALL_PAGE_TTL", "600"))
+ALL_CONCURRENCY = int(os.environ.get("ALL_CONCURRENCY", "2"))
+# per-chat settings snapshots kept in memory
+SETTINGS_CACHE_SIZE = int(os.environ.get("SETTINGS_CACHE_SIZE", "5000"))
+# note keys per chat (for O(1) misses) and recently used note values
+NOTE_INDEX_CHATS = int(os.environ.get("NOTE_INDEX_CHATS", "5000"))
+NOTE_VALUE_CACHE = int(os.environ.get("NOTE_VALUE_CACHE", "2000"))
+# compiled antilink/blocklist rules kept for this many chats
+FILTER_CACHE_SIZE = int(os.environ.get("FILTER_CACHE_SIZE", "10000"))
+# admin lists are refreshed after this many seconds (and on chat_member updates)
+ADMIN_CACHE_TTL = float(os.environ.get("ADMIN_CACHE_TTL", "600"))
+# webhook ingestion: bounded queue processed concurrently on one long-lived loop
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "1000"))
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "16"))
+INGEST_ORDERED = os.environ.get("INGEST_ORDERED", "1") == "1"  # keep each chat's updates in order
+INGEST_PUT_TIMEOUT = float(os.environ.get("INGEST_PUT_TIMEOUT", "5"))
 STICKERS_DIR = Path("stickers")
 STICKERS_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -33,201 +91,458 @@ FLOOD_WINDOW = 6  # seconds
 FLOOD_MUTE = 60   # seconds
 WARN_THRESHOLD = 3
 WARN_MUTE = 600
+FLOOD_SWEEP_INTERVAL = float(os.environ.get("FLOOD_SWEEP_INTERVAL", "30"))
+
+# sticker conversion runs in a process pool
+CONVERT_WORKERS = int(os.environ.get("CONVERT_WORKERS", "2"))
+CONVERT_QUEUE = int(os.environ.get("CONVERT_QUEUE", "16"))
+CONVERT_TIMEOUT = float(os.environ.get("CONVERT_TIMEOUT", "20"))
+# converted stickers: memory LRU + on-disk cache under STICKERS_DIR/cache
+STICKER_CACHE_MEM_MB = int(os.environ.get("STICKER_CACHE_MEM_MB", "32"))
+STICKER_CACHE_MB = int(os.environ.get("STICKER_CACHE_MB", "256"))
+# /kang keeps a local copy of each kanged sticker (deduplicated by content) under STICKERS_DIR/kang
+KANG_STORE_MB = int(os.environ.get("KANG_STORE_MB", "128"))
+# largest source image /q and /kang will download
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", str(10 * 2**20)))
+# WEBP encoder profile: speed | balanced | size (see imaging.PROFILES)
+WEBP_PROFILE = os.environ.get("WEBP_PROFILE", "balanced")
+if WEBP_PROFILE not in PROFILE_NAMES:
+    WEBP_PROFILE = "balanced"  # what the encoder falls back to; keeps cache keys accurate
+# /purge: recently seen message ids per chat, bulk/concurrent deletion
+MSG_INDEX_PER_CHAT = int(os.environ.get("MSG_INDEX_PER_CHAT", "3000"))
+PURGE_CONCURRENCY = int(os.environ.get("PURGE_CONCURRENCY", "8"))
+PURGE_BULK_SIZE = 100  # Bot API deleteMessages limit
+PURGE_BLIND_MAX = int(os.environ.get("PURGE_BLIND_MAX", "300"))
+# cosmetic replies waiting on one chat's send bucket; more are dropped, not queued
+SAY_MAX_PENDING = int(os.environ.get("SAY_MAX_PENDING", "10"))
+# outbound Bot API limits (Telegram: ~30 req/s overall, ~20 msg/min per group)
+API_RATE = float(os.environ.get("API_RATE", "30"))
+API_GROUP_PER_MINUTE = int(os.environ.get("API_GROUP_PER_MINUTE", "20"))
+# flood windows and dedup markers: memory:// (default) or sqlite:///path to share them
+# between processes and keep them across restarts; other caches stay per process, so
+# several workers must be chat-sharded (SHARD_COUNT), not just given one STATE_URL
+STATE_URL = os.environ.get("STATE_URL", "memory://")
+# chat sharding across workers (SHARD_INDEX/COUNT are set per worker by gunicorn.conf.py);
+# updates for other shards are forwarded to SHARD_PEERS[i], default loopback SHARD_PORT_BASE+i
+SHARD_INDEX = int(os.environ.get("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+SHARD_PORT_BASE = int(os.environ.get("SHARD_PORT_BASE", "9100"))
+SHARD_LISTEN = os.environ.get("SHARD_LISTEN", "127.0.0.1")
+SHARD_PEERS = [p.strip().rstrip("/") for p in os.environ.get("SHARD_PEERS", "").split(",") if p.strip()]
+# sticker bans are cached per worker; other workers' edits are picked up this often
+STICKER_BAN_SYNC = float(os.environ.get("STICKER_BAN_SYNC", "5"))
+# webhook redeliveries: this many recent update_ids are remembered (per process, plus
+# a STATE_URL marker for DEDUP_TTL seconds when the state backend is shared)
+DEDUP_WINDOW = int(os.environ.get("DEDUP_WINDOW", "20000"))
+DEDUP_TTL = float(os.environ.get("DEDUP_TTL", "3600"))
+# updates slower than this are logged with their span tree
+SLOW_UPDATE_MS = float(os.environ.get("SLOW_UPDATE_MS", "1000"))
+# sampling profiler: PROFILE=1 starts it at boot (or toggle with /profile); writes collapsed stacks
+PROFILE = os.environ.get("PROFILE", "0") == "1"
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+PROFILE_PATH = os.environ.get("PROFILE_PATH", "profile.folded")
+# raid mode: this many joins / messages inside the window switch a chat to
+# merged welcomes and a single edited moderation summary for RAID_COOLDOWN seconds
+RAID_JOIN_BURST = int(os.environ.get("RAID_JOIN_BURST", "5"))
+RAID_JOIN_WINDOW = float(os.environ.get("RAID_JOIN_WINDOW", "10"))
+RAID_MSG_BURST = int(os.environ.get("RAID_MSG_BURST", "30"))
+RAID_MSG_WINDOW = float(os.environ.get("RAID_MSG_WINDOW", "5"))
+RAID_COOLDOWN = float(os.environ.get("RAID_COOLDOWN", "60"))
+NOTICE_WINDOW = float(os.environ.get("NOTICE_WINDOW", "3"))
 
 # setup logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 log = logging.getLogger(__name__)
 
-# keep recent message timestamps for flood control
-_recent = {}
+# flood control: per-(chat, user) ring of recent message timestamps
+flood = FloodControl(FLOOD_LIMIT, FLOOD_WINDOW)
+state = open_state(STATE_URL)
+router = ShardRouter(SHARD_INDEX, SHARD_COUNT,
+                     SHARD_PEERS or [f"http://127.0.0.1:{SHARD_PORT_BASE + i}" for i in range(SHARD_COUNT)])
+# per-chat raid detection and notice coalescing
+notices = NoticeAggregator(window=NOTICE_WINDOW, join_burst=RAID_JOIN_BURST, join_window=RAID_JOIN_WINDOW,
+                           msg_burst=RAID_MSG_BURST, msg_window=RAID_MSG_WINDOW, cooldown=RAID_COOLDOWN)
 
 # ------------- DB -------------
+# every helper runs on the storage executor over a persistent WAL connection
+db = Storage(DB_PATH, workers=DB_WORKERS)
+# upsert in place: the row keeps its rowid and last_seen only moves forward
+members_wb = WriteBehind(db, "INSERT INTO members (chat_id, user_id, name, last_seen) VALUES (?,?,?,?) "
+                             "ON CONFLICT(chat_id, user_id) DO UPDATE SET name=excluded.name, "
+                             "last_seen=MAX(last_seen, excluded.last_seen)",
+                         max_pending=MEMBER_FLUSH_SIZE, interval=MEMBER_FLUSH_INTERVAL)
+
 def init_db():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("CREATE TABLE IF NOT EXISTS banned_stickers (file_unique_id TEXT UNIQUE)")
-    cur.execute("CREATE TABLE IF NOT EXISTS warnings (chat_id INTEGER, user_id INTEGER, warns INTEGER, PRIMARY KEY(chat_id,user_id))")
-    cur.execute("CREATE TABLE IF NOT EXISTS settings (chat_id INTEGER, key TEXT, value TEXT, PRIMARY KEY(chat_id,key))")
-    cur.execute("CREATE TABLE IF NOT EXISTS notes (chat_id INTEGER, key TEXT, value TEXT, PRIMARY KEY(chat_id,key))")
-    cur.execute("CREATE TABLE IF NOT EXISTS members (chat_id INTEGER, user_id INTEGER, name TEXT, PRIMARY KEY(chat_id,user_id))")
-    con.commit(); con.close()
-
-def add_banned(uid):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("INSERT OR IGNORE INTO banned_stickers VALUES (?)", (uid,))
-    con.commit(); con.close()
-
-def remove_banned(uid):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("DELETE FROM banned_stickers WHERE file_unique_id=?", (uid,))
-    con.commit(); con.close()
-
-def is_banned(uid):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT 1 FROM banned_stickers WHERE file_unique_id=?", (uid,))
-    r = cur.fetchone()
-    con.close()
-    return bool(r)
-
-def warn_user(chat_id, user_id):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT warns FROM warnings WHERE chat_id=? AND user_id=?", (chat_id, user_id))
-    r = cur.fetchone()
+    def _init(con):
+        cur = con.cursor()
+        # every worker runs this at import: take the write lock first so the
+        # check-then-ALTER migrations below cannot interleave (committed by call_sync)
+        if not con.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        cur.execute("CREATE TABLE IF NOT EXISTS banned_stickers (file_unique_id TEXT UNIQUE)")
+        cur.execute("CREATE TABLE IF NOT EXISTS warnings (chat_id INTEGER, user_id INTEGER, warns INTEGER, PRIMARY KEY(chat_id,user_id))")
+        cur.execute("CREATE TABLE IF NOT EXISTS settings (chat_id INTEGER, key TEXT, value TEXT, PRIMARY KEY(chat_id,key))")
+        cur.execute("CREATE TABLE IF NOT EXISTS notes (chat_id INTEGER, key TEXT, value TEXT, PRIMARY KEY(chat_id,key))")
+        cur.execute("CREATE TABLE IF NOT EXISTS members (chat_id INTEGER, user_id INTEGER, name TEXT, last_seen INTEGER NOT NULL DEFAULT 0, PRIMARY KEY(chat_id,user_id))")
+        if "last_seen" not in [c[1] for c in cur.execute("PRAGMA table_info(members)")]:
+            cur.execute("ALTER TABLE members ADD COLUMN last_seen INTEGER NOT NULL DEFAULT 0")
+            # older rows: keep their rowid (insertion) order, ending at now
+            cur.execute("UPDATE members SET last_seen = ? + rowid - (SELECT MAX(rowid) FROM members)", (int(time.time()),))
+        # covers "most recently seen in a chat" and pruning without touching the table
+        cur.execute("CREATE INDEX IF NOT EXISTS members_recent ON members (chat_id, last_seen, user_id, name)")
+        cur.execute("CREATE INDEX IF NOT EXISTS members_last_seen ON members (last_seen)")
+        # per-chat sticker bans; kind is 'file' (file_unique_id) or 'set' (set_name), chat_id 0 = all chats
+        cur.execute("CREATE TABLE IF NOT EXISTS chat_sticker_bans (chat_id INTEGER, kind TEXT, value TEXT, PRIMARY KEY(chat_id,kind,value))")
+        # antilink/blocklist entries; kind is 'allow' / 'deny' (domains) or 'word'
+        cur.execute("CREATE TABLE IF NOT EXISTS chat_filters (chat_id INTEGER, kind TEXT, value TEXT, PRIMARY KEY(chat_id,kind,value))")
+        PackRegistry.init(con)
+        # generation counters for state cached in every worker (bumped on edits)
+        cur.execute("CREATE TABLE IF NOT EXISTS generations (key TEXT PRIMARY KEY, value INTEGER)")
+    db.call_sync(_init)
+    load_sticker_index()
+
+# banned stickers: served from an in-memory index, DB is only touched on edits.
+# Global bans matter to every shard, so edits bump a generation row and the
+# other workers reload when they see it change.
+sticker_index = StickerIndex()
+_sticker_gen = None
+
+def _bump_gen(con, key):
+    return con.execute("INSERT INTO generations VALUES (?,1) ON CONFLICT(key) DO UPDATE SET value=value+1 "
+                       "RETURNING value", (key,)).fetchone()[0]
+
+def _load_sticker_bans(con):
+    gen = con.execute("SELECT value FROM generations WHERE key='sticker_bans'").fetchone()
+    rows = [(0, "file", r[0]) for r in con.execute("SELECT file_unique_id FROM banned_stickers")]
+    rows += con.execute("SELECT chat_id, kind, value FROM chat_sticker_bans").fetchall()
+    return (gen[0] if gen else 0), rows
+
+def load_sticker_index():
+    global _sticker_gen
+    _sticker_gen, rows = db.call_sync(_load_sticker_bans)
+    sticker_index.load(rows)
+
+async def sync_sticker_index():
+    global _sticker_gen
+    while True:
+        await asyncio.sleep(STICKER_BAN_SYNC)
+        try:
+            row = await db.fetchone("SELECT value FROM generations WHERE key='sticker_bans'")
+            if (row[0] if row else 0) != _sticker_gen:
+                _sticker_gen, rows = await db.call(_load_sticker_bans)
+                sticker_index.load(rows)
+        except Exception:
+            log.exception("Sticker ban sync failed.")
+
+def _edit_ban(con, sql, params):
+    con.execute(sql, params)
+    return _bump_gen(con, "sticker_bans")
+
+async def _apply_ban_edit(sql, params):
+    global _sticker_gen
+    gen = await db.call(_edit_ban, sql, params)
+    # only skip the reload if nobody else edited in between
+    if gen == (_sticker_gen or 0) + 1:
+        _sticker_gen = gen
+
+async def add_banned(uid, chat_id=None, kind="file"):
+    if chat_id is None and kind == "file":
+        await _apply_ban_edit("INSERT OR IGNORE INTO banned_stickers VALUES (?)", (uid,))
+    else:
+        await _apply_ban_edit("INSERT OR IGNORE INTO chat_sticker_bans VALUES (?,?,?)", (chat_id or 0, kind, uid))
+    sticker_index.add(chat_id, kind, uid)
+
+async def remove_banned(uid, chat_id=None, kind="file"):
+    if chat_id is None and kind == "file":
+        await _apply_ban_edit("DELETE FROM banned_stickers WHERE file_unique_id=?", (uid,))
+    else:
+        await _apply_ban_edit("DELETE FROM chat_sticker_bans WHERE chat_id=? AND kind=? AND value=?", (chat_id or 0, kind, uid))
+    sticker_index.remove(chat_id, kind, uid)
+
+def is_banned(uid, chat_id=None, set_name=None):
+    return sticker_index.is_banned(chat_id, uid, set_name)
+
+def list_banned(chat_id=None):
+    return sticker_index.entries(chat_id)
+
+def _warn_user(con, chat_id, user_id):
+    r = con.execute("SELECT warns FROM warnings WHERE chat_id=? AND user_id=?", (chat_id, user_id)).fetchone()
     if r:
         nw = r[0] + 1
-        cur.execute("UPDATE warnings SET warns=? WHERE chat_id=? AND user_id=?", (nw, chat_id, user_id))
+        con.execute("UPDATE warnings SET warns=? WHERE chat_id=? AND user_id=?", (nw, chat_id, user_id))
     else:
         nw = 1
-        cur.execute("INSERT INTO warnings VALUES (?,?,?)", (chat_id, user_id, nw))
-    con.commit(); con.close()
+        con.execute("INSERT INTO warnings VALUES (?,?,?)", (chat_id, user_id, nw))
     return nw
 
-def warnings_of(chat_id, user_id):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT warns FROM warnings WHERE chat_id=? AND user_id=?", (chat_id, user_id))
-    r = cur.fetchone()
-    con.close()
+async def warn_user(chat_id, user_id):
+    return await db.call(_warn_user, chat_id, user_id)
+
+async def warnings_of(chat_id, user_id):
+    r = await db.fetchone("SELECT warns FROM warnings WHERE chat_id=? AND user_id=?", (chat_id, user_id))
     return r[0] if r else 0
 
-def db_set_setting(chat_id, key, value):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("INSERT OR REPLACE INTO settings VALUES (?,?,?)", (chat_id, key, value))
-    con.commit(); con.close()
-
-def db_get_setting(chat_id, key):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT value FROM settings WHERE chat_id=? AND key=?", (chat_id, key))
-    r = cur.fetchone()
-    con.close()
-    return r[0] if r else None
-
-def db_set_note(chat_id, key, value):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("INSERT OR REPLACE INTO notes VALUES (?,?,?)", (chat_id, key, value))
-    con.commit(); con.close()
-
-def db_get_note(chat_id, key):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT value FROM notes WHERE chat_id=? AND key=?", (chat_id, key))
-    r = cur.fetchone()
-    con.close()
-    return r[0] if r else None
-
-def db_del_note(chat_id, key):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("DELETE FROM notes WHERE chat_id=? AND key=?", (chat_id, key))
-    con.commit(); con.close()
-
-def db_list_notes(chat_id):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT key FROM notes WHERE chat_id=?", (chat_id,))
-    out = [r[0] for r in cur.fetchall()]
-    con.close()
-    return out
+# settings: one snapshot dict per chat, loaded in a single query and updated write-through
+settings_cache = LRUCache(SETTINGS_CACHE_SIZE)
+_settings_gen = 0
+
+async def chat_settings(chat_id):
+    snap = settings_cache.get(chat_id)
+    if snap is None:
+        gen = _settings_gen
+        rows = await db.fetchall("SELECT key, value FROM settings WHERE chat_id=?", (chat_id,))
+        snap = dict(rows)
+        # a write that raced the load wins; don't cache a stale snapshot
+        if gen == _settings_gen:
+            settings_cache.put(chat_id, snap)
+    return snap
+
+async def db_set_setting(chat_id, key, value):
+    global _settings_gen
+    await db.execute("INSERT OR REPLACE INTO settings VALUES (?,?,?)", (chat_id, key, value))
+    _settings_gen += 1
+    snap = settings_cache.peek(chat_id)
+    if snap is not None:
+        snap[key] = value
+
+async def db_get_setting(chat_id, key):
+    return (await chat_settings(chat_id)).get(key)
+
+# notes: key set per chat loaded once, values fetched on first use; writes keep both in sync
+note_index = NoteIndex(max_chats=NOTE_INDEX_CHATS, max_values=NOTE_VALUE_CACHE)
+_notes_gen = 0
+
+async def _note_keys(chat_id):
+    keys = note_index.keys(chat_id)
+    if keys is None:
+        gen = _notes_gen
+        rows = await db.fetchall("SELECT key FROM notes WHERE chat_id=?", (chat_id,))
+        keys = [r[0] for r in rows]
+        if gen == _notes_gen:
+            note_index.load(chat_id, keys)
+            keys = note_index.keys(chat_id)
+        else:
+            keys = sorted(keys)
+    return keys
+
+async def db_set_note(chat_id, key, value):
+    global _notes_gen
+    await db.execute("INSERT OR REPLACE INTO notes VALUES (?,?,?)", (chat_id, key, value))
+    _notes_gen += 1
+    note_index.set(chat_id, key, value)
+
+async def db_get_note(chat_id, key):
+    known = note_index.has(chat_id, key)
+    if known is None:
+        known = key in await _note_keys(chat_id)
+    if not known:
+        return None
+    val = note_index.values.get((chat_id, key))
+    if val is None:
+        r = await db.fetchone("SELECT value FROM notes WHERE chat_id=? AND key=?", (chat_id, key))
+        if not r:
+            return None
+        val = r[0]
+        note_index.values.put((chat_id, key), val)
+    return val
+
+async def db_del_note(chat_id, key):
+    global _notes_gen
+    await db.execute("DELETE FROM notes WHERE chat_id=? AND key=?", (chat_id, key))
+    _notes_gen += 1
+    note_index.delete(chat_id, key)
+
+async def db_list_notes(chat_id):
+    return list(await _note_keys(chat_id))
+
+async def suggest_notes(chat_id, key):
+    await _note_keys(chat_id)
+    return note_index.suggest(chat_id, key)
+
+# antilink/blocklist: rules compiled per chat on first use, dropped whenever an admin edits them
+filter_engine = FilterEngine(FILTER_CACHE_SIZE)
+_filters_gen = 0
+
+async def chat_filters(chat_id):
+    rules = filter_engine.get(chat_id)
+    if rules is None:
+        gen = _filters_gen
+        rows = await db.fetchall("SELECT kind, value FROM chat_filters WHERE chat_id=?", (chat_id,))
+        if gen == _filters_gen:
+            rules = filter_engine.load(chat_id, rows)
+        else:
+            rules = linkfilter.Rules(*([v for k, v in rows if k == kind] for kind in linkfilter.KINDS))
+    return rules
+
+async def db_add_filter(chat_id, kind, value):
+    global _filters_gen
+    await db.execute("INSERT OR IGNORE INTO chat_filters VALUES (?,?,?)", (chat_id, kind, value))
+    _filters_gen += 1
+    filter_engine.invalidate(chat_id)
 
-def add_seen_member(chat_id, user_id, name):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("INSERT OR REPLACE INTO members VALUES (?,?,?)", (chat_id, user_id, name))
-    con.commit(); con.close()
+async def db_del_filter(chat_id, kind, value):
+    global _filters_gen
+    await db.execute("DELETE FROM chat_filters WHERE chat_id=? AND kind=? AND value=?", (chat_id, kind, value))
+    _filters_gen += 1
+    filter_engine.invalidate(chat_id)
 
-def get_seen_members(chat_id, limit=50):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT user_id, name FROM members WHERE chat_id=? ORDER BY rowid DESC LIMIT ?", (chat_id, limit))
-    rows = cur.fetchall()
-    con.close()
-    return rows
+# /all mention pages per chat, dropped when a new member is seen or members are pruned
+mention_pages = MentionPages(ttl=ALL_PAGE_TTL)
+
+def add_seen_member(chat_id, user_id, name):
+    seen = int(time.time()) // MEMBER_SEEN_RESOLUTION * MEMBER_SEEN_RESOLUTION
+    members_wb.add((chat_id, user_id), (chat_id, user_id, name, seen))
+    mention_pages.seen(chat_id, user_id)
+
+async def get_seen_members(chat_id, limit=50, since=0):
+    await members_wb.aflush()
+    return await db.fetchall("SELECT user_id, name FROM members WHERE chat_id=? AND last_seen>=? "
+                             "ORDER BY last_seen DESC LIMIT ?", (chat_id, since, limit))
+
+async def get_mention_pages(chat_id):
+    pages = mention_pages.get(chat_id)
+    if pages is not None:
+        return pages
+    rows = await get_seen_members(chat_id, ALL_MAX_MEMBERS, time.time() - ALL_ACTIVE_DAYS * 86400)
+    pages, ids = chunk_mentions(rows, max_mentions=ALL_PAGE_MENTIONS)
+    mention_pages.put(chat_id, pages, ids)
+    return pages
+
+async def prune_members():
+    while True:
+        await asyncio.sleep(MEMBER_PRUNE_INTERVAL)
+        try:
+            await members_wb.aflush()
+            n = await db.execute("DELETE FROM members WHERE last_seen < ?", (time.time() - MEMBER_RETENTION_DAYS * 86400,))
+            if n:
+                mention_pages.invalidate()
+                log.info("Pruned %d stale members.", n)
+        except Exception:
+            log.exception("Member prune failed.")
 
 # ------------- UTIL -------------
+admin_cache = AdminCache(ttl=ADMIN_CACHE_TTL)
+
 async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id=None):
     try:
         chat = update.effective_chat.id
         uid = user_id or update.effective_user.id
+    except Exception:
+        return False
+    if update.effective_chat.type != "private":
+        try:
+            return await admin_cache.is_admin(context.bot, chat, uid)
+        except Exception:
+            pass
+    # no administrator list for this chat (e.g. private chat): ask directly
+    try:
         mem = await context.bot.get_chat_member(chat, uid)
         return mem.status in ("administrator", "creator")
     except Exception:
         return False
 
-async def file_bytes(bot_file):
-    bio = io.BytesIO()
+_say_pending = {}  # chat_id -> say() replies not yet sent
+say_stats = {"sent": 0, "failed": 0, "dropped": 0}
+
+async def _say(message, text, kw):
     try:
-        await bot_file.download_to_memory(out=bio)
-    except Exception:
-        await bot_file.download(out=bio)
-    bio.seek(0)
-    return bio.read()
-
-def img_to_webp(raw):
-    img = Image.open(io.BytesIO(raw)).convert("RGBA")
-    max_dim = 512
-    w, h = img.size
-    scale = min(max_dim / w, max_dim / h, 1)
-    new_w = int(w * scale); new_h = int(h * scale)
-    img = img.resize((new_w, new_h), Image.LANCZOS)
-    canvas = Image.new("RGBA", (max_dim, max_dim), (0,0,0,0))
-    canvas.paste(img, ((max_dim-new_w)//2, (max_dim-new_h)//2), img)
-    out = io.BytesIO()
-    canvas.save(out, "WEBP", lossless=True)
-    out.seek(0)
-    return out
-
-def text_to_webp_image(text):
-    max_dim = 512
-    canvas = Image.new("RGBA", (max_dim, max_dim), (0,0,0,0))
-    draw = ImageDraw.Draw(canvas)
-    font = None
-    for fpath in ("/system/fonts/DroidSans.ttf", "/system/fonts/Roboto-Regular.ttf", "DejaVuSans.ttf"):
+        await message.reply_text(text, **kw)
+        say_stats["sent"] += 1
+    except Exception as e:
+        say_stats["failed"] += 1
+        log.warning("Reply in %s failed: %s", message.chat_id, e)
+    finally:
+        n = _say_pending.pop(message.chat_id, 1) - 1
+        if n: _say_pending[message.chat_id] = n
+
+def say(update, context, text, **kw):
+    """Reply in the background. Cosmetic sends wait on the chat's send bucket;
+    awaiting them would hold the chat's ingest queue (and its moderation) behind them.
+    Once SAY_MAX_PENDING replies are waiting in a chat, further ones are dropped."""
+    message = update.effective_message
+    n = _say_pending.get(message.chat_id, 0)
+    if n >= SAY_MAX_PENDING:
+        say_stats["dropped"] += 1
+        return
+    _say_pending[message.chat_id] = n + 1
+    context.application.create_task(_say(message, text, kw), update=update)
+
+msg_index = MessageIndex(per_chat=MSG_INDEX_PER_CHAT)
+
+async def track_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.effective_message
+    if msg and update.effective_chat:
+        msg_index.add(update.effective_chat.id, msg.message_id)
+
+async def track_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cmu = update.chat_member or update.my_chat_member
+    if not cmu: return
+    admin_cache.apply_member_update(cmu.chat.id, cmu.new_chat_member.user.id, cmu.new_chat_member.status)
+
+async def file_bytes(bot_file):
+    with tracing.span("download"):
+        return await media.download(bot_file, MEDIA_MAX_BYTES)
+
+converter = ConversionService(workers=CONVERT_WORKERS, max_pending=CONVERT_QUEUE, timeout=CONVERT_TIMEOUT)
+
+def _encoded(result):
+    data, info = result
+    log.info("Sticker encoded: %s q=%s, %d bytes, %d tries, %.0f ms",
+             info["mode"], info["quality"], info["bytes"], info["tries"], info["encode_ms"])
+    return io.BytesIO(data)
+
+def _imaging():
+    # Pillow is only needed once a sticker is made; keep it off the startup path
+    import imaging
+    return imaging
+
+async def img_to_webp(raw):
+    return _encoded(await converter.run(_imaging().convert_image, raw, WEBP_PROFILE))
+
+async def text_to_webp_image(text):
+    return _encoded(await converter.run(_imaging().render_text, text, WEBP_PROFILE))
+
+sticker_cache = StickerCache(STICKERS_DIR / "cache", mem_bytes=STICKER_CACHE_MEM_MB * 2**20, disk_bytes=STICKER_CACHE_MB * 2**20)
+kang_store = BlobStore(STICKERS_DIR / "kang", KANG_STORE_MB * 2**20)
+sticker_packs = PackRegistry(db)
+
+async def cached_webp(key, render):
+    """Encoded sticker for key, rendering (and caching) it on a miss."""
+    data = await sticker_cache.get(key)
+    if data is None:
+        data = (await render()).getvalue()
+        await sticker_cache.put(key, data)
+    return io.BytesIO(data)
+
+async def send_cached_sticker(chat_id, key, render, bot, **kw):
+    # same source already sent once: resend by file_id, no upload
+    fid = sticker_cache.file_id(key)
+    if fid:
         try:
-            font = ImageFont.truetype(fpath, 36); break
+            return await bot.send_sticker(chat_id, fid, **kw)
         except Exception:
-            font = None
-    if not font:
-        font = ImageFont.load_default()
-
-    words = text.split()
-    lines = []; cur = ""
-    for w in words:
-        test = (cur + " " + w).strip()
-        bbox = draw.textbbox((0,0), test, font=font)
-        if bbox[2] > max_dim - 40 and cur:
-            lines.append(cur); cur = w
-        else:
-            cur = test
-    if cur: lines.append(cur)
-
-    line_heights = [draw.textbbox((0,0), ln, font=font)[3] - draw.textbbox((0,0), ln, font=font)[1] for ln in lines]
-    total_h = sum(line_heights) + (len(lines)-1)*6
-    y = (max_dim - total_h)//2
-    for ln, lh in zip(lines, line_heights):
-        bbox = draw.textbbox((0,0), ln, font=font)
-        w_text = bbox[2] - bbox[0]
-        x = (max_dim - w_text)//2
-        draw.text((x, y), ln, font=font, fill=(255,255,255,255))
-        y += lh + 6
-
-    out = io.BytesIO()
-    canvas.save(out, "WEBP", lossless=True)
-    out.seek(0)
-    return out
+            sticker_cache.forget_file_id(key)
+    webp = await cached_webp(key, render)
+    sent = await bot.send_sticker(chat_id, webp, **kw)
+    sticker_cache.set_file_id(key, getattr(getattr(sent, "sticker", None), "file_id", None))
+    return sent
 
 # ------------- BOT HANDLERS -------------
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        me = await context.bot.get_me()
-        username = getattr(me, "username", None)
-    except:
-        username = None
+    # filled in once by application.initialize(); no getMe round trip per /start
+    username = context.bot.username
 
     buttons = []
     if username:
         buttons.append([InlineKeyboardButton("➕ Add to group", url=f"https://t.me/{username}?startgroup=true")])
     buttons.append([InlineKeyboardButton("Help ▶", callback_data="help:0"), InlineKeyboardButton("Rules", callback_data="rules")])
     kb = InlineKeyboardMarkup(buttons)
-    await update.message.reply_text("Welcome — Bot running on webhook. Use buttons below.", reply_markup=kb)
+    say(update, context, "Welcome — Bot running on webhook. Use buttons below.", reply_markup=kb)
 
 HELP = [
-"/bansticker (reply) — ban sticker\n/allowsticker (reply) — unban\n/liststickers — list banned\n/q (reply to text/image) — make sticker\n/kang (reply to image/sticker) — add to your pack",
+"/bansticker (reply) [chat] — ban sticker\n/allowsticker (reply) — unban\n/banpack /allowpack (reply) — ban whole pack here\n/liststickers — list banned\n/q (reply to text/image) — make sticker\n/kang (reply to image/sticker) — add to your pack",
 "/warn (reply) — warn user\n/warnings (reply) — show warns\n/mute (reply) — mute user\n/unmute (reply)\n/kick (reply)\n/ban (reply)\n/unban <id>",
-"/all — mention recent seen members\n/pin (reply) — pin\n/add — create invite link\n/purge (reply earliest) — delete range\n/lock /unlock — lock group"
+"/all — mention active members\n/pin (reply) — pin\n/add — create invite link\n/purge (reply earliest) — delete range\n/lock /unlock — lock group\n/flood <n> [secs] — flood limit\n/filter allow|deny|word <value> — link/word filters\n/unfilter … — remove\n/filters — list"
 ]
 
 async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -246,36 +561,55 @@ async def cb_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try: await q.message.delete()
         except: pass
     elif d == "rules":
-        r = db_get_setting(q.message.chat.id, "rules") or "No rules set."
+        r = await db_get_setting(q.message.chat.id, "rules") or "No rules set."
         await q.message.reply_text(r)
 
 # sticker management
 async def bansticker(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     r = update.message.reply_to_message
-    if not r or not r.sticker: return await update.message.reply_text("Reply to sticker.")
-    add_banned(r.sticker.file_unique_id)
-    await update.message.reply_text("Sticker banned.")
+    if not r or not r.sticker: return say(update, context, "Reply to sticker.")
+    # "/bansticker chat" limits the ban to this chat
+    if context.args and context.args[0].lower() == "chat":
+        await add_banned(r.sticker.file_unique_id, update.effective_chat.id)
+        return say(update, context, "Sticker banned in this chat.")
+    await add_banned(r.sticker.file_unique_id)
+    say(update, context, "Sticker banned.")
 
 async def allowsticker(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
+    r = update.message.reply_to_message
+    if not r or not r.sticker: return say(update, context, "Reply to sticker.")
+    await remove_banned(r.sticker.file_unique_id)
+    await remove_banned(r.sticker.file_unique_id, update.effective_chat.id)
+    say(update, context, "Sticker unbanned.")
+
+async def banpack(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
+    r = update.message.reply_to_message
+    if not r or not r.sticker: return say(update, context, "Reply to sticker.")
+    if not r.sticker.set_name: return say(update, context, "That sticker is not from a pack.")
+    await add_banned(r.sticker.set_name, update.effective_chat.id, kind="set")
+    say(update, context, f"Sticker pack {r.sticker.set_name} banned in this chat.")
+
+async def allowpack(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     r = update.message.reply_to_message
-    if not r or not r.sticker: return await update.message.reply_text("Reply to sticker.")
-    remove_banned(r.sticker.file_unique_id)
-    await update.message.reply_text("Sticker unbanned.")
+    if not r or not r.sticker or not r.sticker.set_name: return say(update, context, "Reply to a sticker from the pack.")
+    await remove_banned(r.sticker.set_name, update.effective_chat.id, kind="set")
+    say(update, context, "Sticker pack unbanned.")
 
 async def liststickers(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT file_unique_id FROM banned_stickers")
-    rows = [r[0] for r in cur.fetchall()]; con.close()
-    if not rows: return await update.message.reply_text("No banned stickers.")
-    txt = "Banned stickers:\n" + "\n".join(rows[:50])
-    await update.message.reply_text(txt)
+    rows = list_banned(update.effective_chat.id)
+    if not rows: return say(update, context, "No banned stickers.")
+    lines = [v if (scope, kind) == ("global", "file") else f"{v} ({'pack' if kind == 'set' else 'sticker'}, {scope})" for scope, kind, v in rows]
+    txt = "Banned stickers:\n" + "\n".join(lines[:50])
+    say(update, context, txt)
 
 async def sticker_auto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     if not msg or not msg.sticker: return
-    if is_banned(msg.sticker.file_unique_id):
+    if is_banned(msg.sticker.file_unique_id, msg.chat.id, msg.sticker.set_name):
         try: await msg.delete()
         except: pass
 
@@ -283,89 +617,119 @@ async def sticker_auto(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def q_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     r = update.message.reply_to_message
     if not r:
-        return await update.message.reply_text("Reply to text or image.")
+        return say(update, context, "Reply to text or image.")
+    chat_id = update.effective_chat.id; reply_id = update.message.message_id
     # text -> sticker
     if r.text and not (r.photo or r.document):
-        webp = text_to_webp_image(r.text)
+        key = StickerCache.key_for_text(r.text, RENDER_VERSION, WEBP_PROFILE)
         try:
-            webp.seek(0)
-            await context.bot.send_sticker(update.effective_chat.id, webp, reply_to_message_id=update.message.message_id)
+            await send_cached_sticker(chat_id, key, lambda: text_to_webp_image(r.text), context.bot, reply_to_message_id=reply_id)
+        except ConversionBusy:
+            say(update, context, "Sticker maker is busy, try again shortly.")
         except Exception:
-            await update.message.reply_text("Failed to send text sticker.")
+            say(update, context, "Failed to send text sticker.")
         return
     # sticker -> resend
     if r.sticker:
-        return await context.bot.send_sticker(update.effective_chat.id, r.sticker.file_id, reply_to_message_id=update.message.message_id)
+        return await context.bot.send_sticker(chat_id, r.sticker.file_id, reply_to_message_id=reply_id)
     # image/document -> convert
-    f = None
     if r.photo:
-        f = await r.photo[-1].get_file()
+        src = media.pick_photo(r.photo)
     elif r.document and getattr(r.document, "mime_type", "").startswith("image"):
-        f = await r.document.get_file()
+        src = r.document
     else:
-        return await update.message.reply_text("Reply to an image or text.")
-    raw = await file_bytes(f)
-    webp = img_to_webp(raw)
+        return say(update, context, "Reply to an image or text.")
+
+    async def render():
+        return await img_to_webp(await media.fetch_image(src, MEDIA_MAX_BYTES))
+
+    key = StickerCache.key_for_file(src.file_unique_id, RENDER_VERSION, WEBP_PROFILE)
     try:
-        webp.seek(0)
-        await context.bot.send_sticker(update.effective_chat.id, webp, reply_to_message_id=update.message.message_id)
+        await send_cached_sticker(chat_id, key, render, context.bot, reply_to_message_id=reply_id)
+    except ConversionBusy:
+        say(update, context, "Sticker maker is busy, try again shortly.")
+    except MediaRejected:
+        say(update, context, "That image is too large or not supported.")
     except Exception:
-        await update.message.reply_text("Sticker convert fail.")
+        say(update, context, "Sticker convert fail.")
 
 # /kang attempt
+async def add_to_pack(bot, user, data, emoji):
+    """Add a sticker to the user's current pack, creating or rolling over packs as needed.
+    Returns (pack name, None) or (None, error text)."""
+    uid = user.id
+    idx, count = await sticker_packs.target(uid)
+    error = None
+    for _ in range(4):
+        name = pack_name(uid, idx, bot.username)
+        sticker = InputSticker(InputFile(data, filename="sticker.webp"), [emoji])
+        try:
+            if count is None:
+                await bot.create_new_sticker_set(uid, name, pack_title(user.first_name, idx), [sticker], "static")
+                await sticker_packs.record(uid, idx, name, 1)
+            else:
+                await bot.add_sticker_to_set(uid, name, sticker)
+                await sticker_packs.record(uid, idx, name, count + 1)
+            return name, None
+        except BadRequest as e:
+            error = e.message
+            err = error.lower()
+        except Exception as e:
+            return None, str(e)
+        if count is not None and "stickerset_invalid" in err:
+            # the user deleted the pack; make it again
+            await sticker_packs.forget(uid, idx)
+            count = None
+        elif count is not None and "too_much" in err.replace(" ", "_"):
+            await sticker_packs.record(uid, idx, name, sticker_packs.limit)
+            idx, count = idx + 1, None
+        elif count is None and "occupied" in err:
+            # made before the registry existed (or elsewhere): learn its size
+            try:
+                count = len((await bot.get_sticker_set(name)).stickers)
+            except Exception:
+                return None, error
+            await sticker_packs.record(uid, idx, name, count)
+            if count >= sticker_packs.limit:
+                idx, count = idx + 1, None
+        else:
+            break
+    return None, error
+
 async def kang_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     r = update.message.reply_to_message
-    if not r: return await update.message.reply_text("Reply to image/sticker to kang.")
+    if not r: return say(update, context, "Reply to image/sticker to kang.")
     emoji = (context.args and context.args[0]) or "🙂"
-    user = update.effective_user; uid = user.id
+    user = update.effective_user
     try:
         if r.sticker:
             f = await r.sticker.get_file()
             raw = await file_bytes(f); webp = io.BytesIO(raw)
         else:
             if r.photo:
-                f = await r.photo[-1].get_file()
+                src = media.pick_photo(r.photo)
             elif r.document and getattr(r.document, "mime_type", "").startswith("image"):
-                f = await r.document.get_file()
+                src = r.document
             else:
-                return await update.message.reply_text("Reply to an image.")
-            raw = await file_bytes(f); webp = img_to_webp(raw)
+                return say(update, context, "Reply to an image.")
+
+            async def render():
+                return await img_to_webp(await media.fetch_image(src, MEDIA_MAX_BYTES))
+            webp = await cached_webp(StickerCache.key_for_file(src.file_unique_id, RENDER_VERSION, WEBP_PROFILE), render)
+    except ConversionBusy:
+        return say(update, context, "Sticker maker is busy, try again shortly.")
+    except MediaRejected:
+        return say(update, context, "That image is too large or not supported.")
     except Exception:
-        return await update.message.reply_text("Failed to read the image. Try again.")
-    # save locally
-    fname = STICKERS_DIR / f"sticker_{int(time.time())}.webp"
+        return say(update, context, "Failed to read the image. Try again.")
+    # save locally (content-addressed, so repeats are stored once)
     try:
-        with open(fname, "wb") as fh:
-            fh.write(webp.getvalue())
+        await asyncio.to_thread(kang_store.put_content, webp.getvalue())
     except Exception:
-        return await update.message.reply_text("Failed to save sticker locally.")
-    # try add to user's pack
-    try:
-        me = await context.bot.get_me(); bot_username = getattr(me, "username", "bot")
-    except:
-        bot_username = "bot"
-    base = f"user_{uid}"
-    suffix = f"_by_{bot_username}"
-    pack_name_raw = (base + suffix)[:64]
-    pack_name = "".join(ch if ch.isalnum() or ch=="_" else "_" for ch in pack_name_raw)
-    pack_title = f"{user.first_name}'s stickers"
-    webp.seek(0)
-    inp = InputFile(webp, filename="sticker.webp")
-    added = False; error_msg = None
-    try:
-        await context.bot.add_sticker_to_set(user_id=uid, name=pack_name, png_sticker=inp, emojis=emoji)
-        added = True
-    except Exception as e_add:
-        error_msg = str(e_add)
-        try:
-            webp.seek(0)
-            await context.bot.create_new_sticker_set(user_id=uid, name=pack_name, title=pack_title, png_sticker=inp, emojis=emoji)
-            added = True
-        except Exception as e_create:
-            error_msg = (error_msg or "") + " | " + str(e_create)
-            added = False
-    if added:
-        await update.message.reply_text(f"Kanged and added to your pack: `{pack_name}` {emoji}", parse_mode="Markdown")
+        return say(update, context, "Failed to save sticker locally.")
+    name, error_msg = await add_to_pack(context.bot, user, webp.getvalue(), emoji)
+    if name:
+        say(update, context, f"Kanged and added to your pack: `{name}` {emoji}", parse_mode="Markdown")
         return
     # fallback: send sticker in chat
     try:
@@ -376,31 +740,31 @@ async def kang_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = "Saved sticker locally but could not add to your pack."
     if error_msg:
         msg += f" Details: {error_msg[:300]}"
-    await update.message.reply_text(msg)
+    say(update, context, msg)
 
 # moderation cmds
 async def warn_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     r = update.message.reply_to_message
-    if not r: return await update.message.reply_text("Reply to user.")
+    if not r: return say(update, context, "Reply to user.")
     uid = r.from_user.id; chat = update.effective_chat.id
-    w = warn_user(chat, uid)
-    await update.message.reply_text(f"Warned → total {w}")
+    w = await warn_user(chat, uid)
+    say(update, context, f"Warned → total {w}")
     if w >= WARN_THRESHOLD:
         try:
             await context.bot.restrict_chat_member(chat, uid, ChatPermissions(can_send_messages=False), until_date=int(time.time())+WARN_MUTE)
-            await update.message.reply_text("Auto-muted for warnings.")
+            say(update, context, "Auto-muted for warnings.")
         except:
             pass
 
 async def warnings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     r = update.message.reply_to_message
-    if not r: return await update.message.reply_text("Reply to user.")
-    w = warnings_of(update.effective_chat.id, r.from_user.id)
-    await update.message.reply_text(f"Warnings: {w}")
+    if not r: return say(update, context, "Reply to user.")
+    w = await warnings_of(update.effective_chat.id, r.from_user.id)
+    say(update, context, f"Warnings: {w}")
 
 async def mute_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     r = update.message.reply_to_message
     if not r: return
     try: mins = int((context.args[0] if context.args else 10))
@@ -408,9 +772,9 @@ async def mute_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = r.from_user.id
     try:
         await context.bot.restrict_chat_member(update.effective_chat.id, uid, ChatPermissions(can_send_messages=False), until_date=int(time.time())+mins*60)
-        await update.message.reply_text(f"Muted {mins} min.")
+        say(update, context, f"Muted {mins} min.")
     except Exception:
-        await update.message.reply_text("Mute fail.")
+        say(update, context, "Mute fail.")
 
 async def unmute_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update, context): return
@@ -420,9 +784,9 @@ async def unmute_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         perms = ChatPermissions(can_send_messages=True, can_send_media_messages=True, can_send_other_messages=True)
         await context.bot.restrict_chat_member(update.effective_chat.id, uid, perms, until_date=0)
-        await update.message.reply_text("Unmuted.")
+        say(update, context, "Unmuted.")
     except:
-        await update.message.reply_text("Unmute fail.")
+        say(update, context, "Unmute fail.")
 
 async def kick_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update, context): return
@@ -432,9 +796,9 @@ async def kick_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         await context.bot.ban_chat_member(chat, uid, until_date=int(time.time())+5)
         await context.bot.unban_chat_member(chat, uid)
-        await update.message.reply_text("Kicked.")
+        say(update, context, "Kicked.")
     except:
-        await update.message.reply_text("Kick fail.")
+        say(update, context, "Kick fail.")
 
 async def ban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update, context): return
@@ -443,217 +807,344 @@ async def ban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = r.from_user.id
     try:
         await context.bot.ban_chat_member(update.effective_chat.id, uid)
-        await update.message.reply_text("Banned.")
+        say(update, context, "Banned.")
     except:
-        await update.message.reply_text("Ban fail.")
+        say(update, context, "Ban fail.")
 
 async def unban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update, context): return
-    if not context.args: return await update.message.reply_text("Use /unban <user_id>")
+    if not context.args: return say(update, context, "Use /unban <user_id>")
     try:
         uid = int(context.args[0])
     except:
-        return await update.message.reply_text("Invalid user id.")
+        return say(update, context, "Invalid user id.")
     try:
         await context.bot.unban_chat_member(update.effective_chat.id, uid)
-        await update.message.reply_text("Unbanned.")
+        say(update, context, "Unbanned.")
     except:
-        await update.message.reply_text("Unban fail.")
+        say(update, context, "Unban fail.")
 
 # rules / welcome / antilink / notes
 async def setrules_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     txt = " ".join(context.args)
-    if not txt: return await update.message.reply_text("Use /setrules text")
-    db_set_setting(update.effective_chat.id, "rules", txt)
-    await update.message.reply_text("Rules saved.")
+    if not txt: return say(update, context, "Use /setrules text")
+    await db_set_setting(update.effective_chat.id, "rules", txt)
+    say(update, context, "Rules saved.")
 
 async def rules_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    r = db_get_setting(update.effective_chat.id, "rules")
-    await update.message.reply_text(r or "No rules.")
+    r = await db_get_setting(update.effective_chat.id, "rules")
+    say(update, context, r or "No rules.")
 
 async def antilink_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     arg = (context.args[0] if context.args else "").lower()
-    if arg not in ("on","off"): return await update.message.reply_text("Use /antilink on|off")
-    db_set_setting(update.effective_chat.id, "antilink", arg)
-    await update.message.reply_text(f"Anti-link: {arg}")
+    if arg not in ("on","off"): return say(update, context, "Use /antilink on|off")
+    await db_set_setting(update.effective_chat.id, "antilink", arg)
+    say(update, context, f"Anti-link: {arg}")
 
 async def setwelcome_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     txt = " ".join(context.args)
-    if not txt: return await update.message.reply_text("Use /setwelcome text (use {name})")
-    db_set_setting(update.effective_chat.id, "welcome", txt)
-    await update.message.reply_text("Welcome saved.")
+    if not txt: return say(update, context, "Use /setwelcome text (use {name})")
+    await db_set_setting(update.effective_chat.id, "welcome", txt)
+    say(update, context, "Welcome saved.")
 
 async def welcome_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     arg = (context.args[0] if context.args else "").lower()
-    if arg not in ("on","off"): return await update.message.reply_text("Use /welcome on|off")
-    db_set_setting(update.effective_chat.id, "welcome_on", arg)
-    await update.message.reply_text(f"Welcome: {arg}")
+    if arg not in ("on","off"): return say(update, context, "Use /welcome on|off")
+    await db_set_setting(update.effective_chat.id, "welcome_on", arg)
+    say(update, context, f"Welcome: {arg}")
 
 async def welcome_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    for m in update.message.new_chat_members:
-        chat = update.effective_chat.id
-        if db_get_setting(chat, "welcome_on") == "on":
-            tpl = db_get_setting(chat, "welcome") or "Welcome {name}!"
-            text = tpl.replace("{name}", m.full_name)
-            try:
-                await update.message.reply_text(text)
-            except:
-                pass
+    chat = update.effective_chat.id
+    members = update.message.new_chat_members
+    notices.note_join(chat, len(members), update.message.date.timestamp())
+    conf = await chat_settings(chat)
+    if conf.get("welcome_on") != "on":
+        return
+    tpl = conf.get("welcome") or "Welcome {name}!"
+    if notices.raid(chat):
+        return notices.queue_welcome(context.bot, chat, [m.full_name for m in members], tpl)
+    for m in members:
+        say(update, context, tpl.replace("{name}", m.full_name))
 
 # notes
 async def setnote_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
-    if len(context.args)<2: return await update.message.reply_text("Use /setnote key value")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
+    if len(context.args)<2: return say(update, context, "Use /setnote key value")
     key = context.args[0].lower()
     val = " ".join(context.args[1:])
-    db_set_note(update.effective_chat.id, key, val)
-    await update.message.reply_text("Note saved.")
+    await db_set_note(update.effective_chat.id, key, val)
+    say(update, context, "Note saved.")
 
 async def note_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.args: return await update.message.reply_text("Use /note key")
+    if not context.args: return say(update, context, "Use /note key")
     key = context.args[0].lower()
-    val = db_get_note(update.effective_chat.id, key)
-    if not val: return await update.message.reply_text("Not found.")
-    await update.message.reply_text(val)
+    val = await db_get_note(update.effective_chat.id, key)
+    if not val:
+        close = await suggest_notes(update.effective_chat.id, key)
+        return say(update, context, "Not found." + (f" Did you mean: {', '.join(close)}?" if close else ""))
+    say(update, context, val)
 
 async def delnote_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
-    if not context.args: return await update.message.reply_text("Use /delnote key")
-    db_del_note(update.effective_chat.id, context.args[0].lower())
-    await update.message.reply_text("Note deleted.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
+    if not context.args: return say(update, context, "Use /delnote key")
+    await db_del_note(update.effective_chat.id, context.args[0].lower())
+    say(update, context, "Note deleted.")
 
 async def listnotes_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    out = db_list_notes(update.effective_chat.id)
-    if not out: return await update.message.reply_text("No notes.")
-    await update.message.reply_text("Notes: " + ", ".join(out))
+    out = await db_list_notes(update.effective_chat.id)
+    if not out: return say(update, context, "No notes.")
+    say(update, context, "Notes: " + ", ".join(out))
 
 # utils: react and info
 async def react_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.reply_to_message:
-        return await update.message.reply_text("Reply to a message and use /react <emoji>")
+        return say(update, context, "Reply to a message and use /react <emoji>")
     emoji = (context.args and context.args[0]) or "👍"
     target = update.message.reply_to_message
-    try:
-        # fallback: reply with emoji
-        await update.message.reply_text(emoji, reply_to_message_id=target.message_id)
-    except:
-        pass
+    # fallback: reply with emoji
+    say(update, context, emoji, reply_to_message_id=target.message_id)
 
 async def info_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     r = update.message.reply_to_message
     if not r:
-        return await update.message.reply_text("Reply to a user.")
+        return say(update, context, "Reply to a user.")
     u = r.from_user
     text = f"User info:\nName: {u.full_name}\nID: {u.id}\nUsername: @{u.username if u.username else 'none'}\nIs bot: {u.is_bot}"
-    await update.message.reply_text(text)
+    say(update, context, text)
 
 # group utilities
+_all_running = set()
+
 async def all_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # up to ALL_MAX_MEMBERS mentions spend minutes of the chat's send budget
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     chat = update.effective_chat
-    rows = get_seen_members(chat.id, limit=50)
-    if not rows:
-        return await update.message.reply_text("No members recorded yet.")
-    parts = []
-    for uid, name in rows:
-        safe_name = (name or "user").replace("`", "")[:50]
-        parts.append(f"[{safe_name}](tg://user?id={uid})")
-    text = " ".join(parts)
-    max_len = 3800
-    if len(text) <= max_len:
-        await update.message.reply_text(text, parse_mode="Markdown")
-        return
-    cur = ""
-    for p in parts:
-        if len(cur) + len(p) + 1 > max_len:
-            await update.message.reply_text(cur, parse_mode="Markdown")
-            cur = p
-        else:
-            cur = (cur + " " + p).strip()
-    if cur:
-        await update.message.reply_text(cur, parse_mode="Markdown")
+    if chat.id in _all_running:
+        return say(update, context, "Already mentioning everyone here.")
+    pages = await get_mention_pages(chat.id)
+    if not pages:
+        return say(update, context, "No members recorded yet.")
+    # pages go out in the background (minutes at group send limits) so the chat's
+    # ingest queue keeps moving; _all_running refuses a second /all meanwhile
+    _all_running.add(chat.id)
+    context.application.create_task(send_mention_pages(update.message, pages), update=update)
+
+async def send_mention_pages(message, pages):
+    # the rate limiter paces the chat; the semaphore only bounds queued sends
+    sem = asyncio.Semaphore(ALL_CONCURRENCY)
+
+    async def one(text):
+        async with sem:
+            try:
+                await message.reply_text(text, parse_mode="Markdown")
+            except Exception as e:
+                log.warning("/all page failed in %s: %s", message.chat_id, e)
+
+    try:
+        await asyncio.gather(*(one(p) for p in pages))
+    finally:
+        _all_running.discard(message.chat_id)
 
 async def pin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     r = update.message.reply_to_message
-    if not r: return await update.message.reply_text("Reply to the message you want to pin.")
+    if not r: return say(update, context, "Reply to the message you want to pin.")
     try:
         await context.bot.pin_chat_message(update.effective_chat.id, r.message_id, disable_notification=False)
-        await update.message.reply_text("Pinned.")
+        say(update, context, "Pinned.")
     except Exception as e:
-        await update.message.reply_text("Pin failed: " + str(e))
+        say(update, context, "Pin failed: " + str(e))
 
 async def add_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     try:
         link = await context.bot.create_chat_invite_link(update.effective_chat.id)
-        await update.message.reply_text(f"Invite link: {link.invite_link}")
+        say(update, context, f"Invite link: {link.invite_link}")
     except Exception as e:
-        await update.message.reply_text("Could not create invite link: " + str(e))
+        say(update, context, "Could not create invite link: " + str(e))
 
 async def purge_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     r = update.message.reply_to_message
-    if not r: return await update.message.reply_text("Reply to the oldest message you want to delete up to the command message.")
+    if not r: return say(update, context, "Reply to the oldest message you want to delete up to the command message.")
     start_id = r.message_id; end_id = update.message.message_id; chat_id = update.effective_chat.id
-    deleted = 0
-    for mid in range(start_id, end_id + 1):
-        try:
-            await context.bot.delete_message(chat_id, mid)
-            deleted += 1
-        except:
-            pass
-    await update.message.reply_text(f"Attempted purge. Deleted approx: {deleted}")
+    ids = set(msg_index.between(chat_id, start_id, end_id)) | {start_id, end_id}
+    # ids older than anything indexed (e.g. before a restart) are unknown: walk that part blindly, capped
+    covered = msg_index.covered_from(chat_id)
+    blind_end = min(end_id, covered - 1) if covered is not None else end_id
+    if blind_end >= start_id:
+        ids.update(range(start_id, min(blind_end, start_id + PURGE_BLIND_MAX - 1) + 1))
+    # deleting (and editing the status at group send limits) takes a while:
+    # run it in the background so the chat's ingest queue keeps moving
+    context.application.create_task(run_purge(context.bot, update.message, sorted(ids)), update=update)
+
+async def run_purge(bot, message, ids):
+    chat_id = message.chat_id
+    # status text waits on the chat's send bucket; the deletes never wait for it
+    status = asyncio.create_task(message.reply_text(f"Purging {len(ids)} messages…"))
+    edits = [None]
+    last = [time.monotonic()]
+
+    async def edit(text):
+        try: await (await status).edit_text(text)
+        except: pass
+
+    async def progress(done, total):
+        if done >= total or not status.done() or time.monotonic() - last[0] < 3: return
+        if edits[0] is not None and not edits[0].done(): return
+        last[0] = time.monotonic()
+        edits[0] = asyncio.create_task(edit(f"Purging… {done}/{total}"))
+
+    deleted = await purge_messages(bot, chat_id, ids, progress)
+    msg_index.discard(chat_id, ids)
+    if edits[0] is not None:
+        await edits[0]
+    await edit(f"Purged {deleted} of {len(ids)} messages.")
+
+async def purge_messages(bot, chat_id, ids, progress=None):
+    """Delete ids, in bulk when the Bot API supports it, else with bounded concurrency.
+    Flood waits are retried by the rate limiter."""
+    done = 0; deleted = 0
+    bulk = getattr(bot, "delete_messages", None)
+    if bulk:
+        for i in range(0, len(ids), PURGE_BULK_SIZE):
+            chunk = ids[i:i + PURGE_BULK_SIZE]
+            try:
+                if await bulk(chat_id, chunk): deleted += len(chunk)
+            except Exception:
+                pass
+            done += len(chunk)
+            if progress: await progress(done, len(ids))
+        return deleted
+    sem = asyncio.Semaphore(PURGE_CONCURRENCY)
+
+    async def one(mid):
+        nonlocal done, deleted
+        async with sem:
+            try:
+                await bot.delete_message(chat_id, mid)
+                deleted += 1
+            except Exception:
+                pass
+            done += 1
+            if progress: await progress(done, len(ids))
+
+    await asyncio.gather(*(one(m) for m in ids))
+    return deleted
 
 async def lock_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     chat = update.effective_chat.id
     try:
         perms = ChatPermissions(can_send_messages=False, can_send_media_messages=False, can_send_other_messages=False, can_add_web_page_previews=False)
         await context.bot.set_chat_permissions(chat, perms)
-        await update.message.reply_text("Group locked for non-admins.")
+        say(update, context, "Group locked for non-admins.")
     except Exception as e:
-        await update.message.reply_text("Lock failed: " + str(e))
+        say(update, context, "Lock failed: " + str(e))
 
 async def unlock_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await is_admin(update, context): return await update.message.reply_text("Admins only.")
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
     chat = update.effective_chat.id
     try:
         perms = ChatPermissions(can_send_messages=True, can_send_media_messages=True, can_send_other_messages=True, can_add_web_page_previews=True)
         await context.bot.set_chat_permissions(chat, perms)
-        await update.message.reply_text("Group unlocked for all members.")
+        say(update, context, "Group unlocked for all members.")
     except Exception as e:
-        await update.message.reply_text("Unlock failed: " + str(e))
+        say(update, context, "Unlock failed: " + str(e))
+
+async def flood_config(chat_id):
+    conf = await chat_settings(chat_id)
+    try:
+        return int(conf.get("flood_limit") or FLOOD_LIMIT), float(conf.get("flood_window") or FLOOD_WINDOW)
+    except ValueError:
+        return FLOOD_LIMIT, FLOOD_WINDOW
+
+async def flood_hit(chat, uid, now, limit, window):
+    # a shared backend keeps the counters outside this process (they survive restarts)
+    if state.shared:
+        return await state.incr_window(f"flood:{chat}:{uid}", window, now) >= limit
+    return flood.hit(chat, uid, now, limit, window)
+
+async def flood_reset(chat, uid):
+    if state.shared:
+        await state.reset_window(f"flood:{chat}:{uid}")
+    else:
+        flood.reset(chat, uid)
+
+async def flood_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
+    chat = update.effective_chat.id
+    if not context.args:
+        limit, window = await flood_config(chat)
+        return say(update, context, f"Flood limit: {limit} msgs / {window:g}s" if limit > 0 else "Flood control: off")
+    try:
+        limit = int(context.args[0])
+        window = float(context.args[1]) if len(context.args) > 1 else None
+        if limit < 0 or limit == 1 or (window is not None and window <= 0): raise ValueError
+    except ValueError:
+        return say(update, context, "Use /flood <limit> [seconds] (0 = off)")
+    await db_set_setting(chat, "flood_limit", str(limit))
+    if window is not None:
+        await db_set_setting(chat, "flood_window", str(window))
+    say(update, context, "Flood control: off" if limit == 0 else "Flood limit saved.")
+
+FILTER_USAGE = "Use /filter allow|deny <domain> or /filter word <text> (/unfilter to remove)"
+
+async def filter_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context): return say(update, context, "Admins only.")
+    kind = (context.args[0].lower() if context.args else "")
+    value = linkfilter.normalize(kind, " ".join(context.args[1:]))
+    if kind not in linkfilter.KINDS or not value: return say(update, context, FILTER_USAGE)
+    remove = update.message.text.lstrip("/").lower().startswith("unfilter")
+    if remove:
+        await db_del_filter(update.effective_chat.id, kind, value)
+    else:
+        await db_add_filter(update.effective_chat.id, kind, value)
+    say(update, context, f"{'Removed' if remove else 'Added'} {kind}: {value}")
+
+async def filters_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    rules = await chat_filters(update.effective_chat.id)
+    if not rules: return say(update, context, "No filters.")
+    lines = [f"{name}: {', '.join(sorted(items))}" for name, items in
+             (("Allowed domains", rules.allow), ("Denied domains", rules.deny), ("Blocked words", rules.words)) if items]
+    say(update, context, "\n".join(lines))
 
 # automod
-LINK_RE = __import__("re").compile(r"(https?://|t\.me|telegram\.me)", __import__("re").I)
+FILTER_NOTICES = {"link": "Links not allowed.", "domain": "Links to that site are not allowed.",
+                  "word": "Message removed: blocked word."}
 
 async def auto_mod(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     if not msg: return
-    # anti-link
-    if msg.text:
-        if db_get_setting(msg.chat.id, "antilink") == "on":
-            if not await is_admin(update, context):
-                if LINK_RE.search(msg.text):
-                    try: await msg.delete()
-                    except: pass
-                    return await update.message.reply_text("Links not allowed.")
+    # anti-link / blocklist: entities first, then the chat's compiled rules
+    text = msg.text or msg.caption
+    if text:
+        antilink = await db_get_setting(msg.chat.id, "antilink") == "on"
+        rules = await chat_filters(msg.chat.id)
+        if antilink or rules:
+            reason = rules.check(text, linkfilter.message_urls(msg), antilink)
+            if reason and not await is_admin(update, context):
+                try: await msg.delete()
+                except: pass
+                if notices.raid(msg.chat.id):
+                    return notices.fold_notice(context.bot, msg.chat.id, reason)
+                return say(update, context, FILTER_NOTICES[reason])
     # flood-control
     chat = msg.chat.id; uid = msg.from_user.id; now = time.time()
-    d = _recent.setdefault(chat, {}).setdefault(uid, [])
-    d[:] = [x for x in d if x > now - FLOOD_WINDOW]
-    d.append(now)
-    if len(d) >= FLOOD_LIMIT and not await is_admin(update, context):
+    limit, window = await flood_config(chat)
+    if limit > 0 and await flood_hit(chat, uid, now, limit, window) and not await is_admin(update, context):
         try:
             await context.bot.restrict_chat_member(chat, uid, ChatPermissions(can_send_messages=False), until_date=int(time.time())+FLOOD_MUTE)
         except:
             pass
-        d.clear()
-        await update.message.reply_text("Muted for flooding.")
+        await flood_reset(chat, uid)
+        if notices.raid(chat):
+            return notices.fold_notice(context.bot, chat, "flood")
+        say(update, context, "Muted for flooding.")
 
 # catch-all message handler
 async def msg_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -664,6 +1155,8 @@ async def msg_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if msg.from_user and not msg.from_user.is_bot:
             add_seen_member(msg.chat.id, msg.from_user.id, msg.from_user.full_name)
     except: pass
+    # every message counts toward raid detection, stickers included
+    notices.note_message(msg.chat.id, msg.date.timestamp())
     # sticker moderation
     if msg.sticker:
         return await sticker_auto(update, context)
@@ -671,22 +1164,42 @@ async def msg_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # quick reaction to literal "start"
     txt = (msg.text or "").strip()
     if txt and txt.lower() == "start":
-        try:
-            await msg.reply_text("✅", reply_to_message_id=msg.message_id)
-        except:
-            pass
+        say(update, context, "✅", reply_to_message_id=msg.message_id)
     # notes quick .key
     if txt.startswith(".") and len(txt)>1:
         key = txt[1:].split()[0].lower()
-        val = db_get_note(update.effective_chat.id, key)
+        val = await db_get_note(update.effective_chat.id, key)
         if val:
-            await update.message.reply_text(val)
+            say(update, context, val)
+
+# operator: sampling profiler on/off (owner only)
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not OWNER_ID or update.effective_user.id != OWNER_ID: return
+    arg = (context.args[0] if context.args else "").lower()
+    if arg == "on":
+        profiler.start()
+        return say(update, context, f"Profiler on ({profiler.interval * 1000:g}ms).")
+    if arg == "off":
+        path = await asyncio.to_thread(profiler.stop)
+        return say(update, context, f"Profiler off, stacks in {path}." if path else "Profiler was not running.")
+    say(update, context, f"Profiler: {'on' if profiler.running else 'off'}. Use /profile on|off")
 
 # ------------- SETUP APPLICATION (handlers) -------------
-# Build the Application once (no polling)
-application = ApplicationBuilder().token(TOKEN).build()
+# Build the Application once (no polling); all Bot API calls go through the scheduler
+api_limiter = PriorityRateLimiter(overall_rate=API_RATE, group_per_minute=API_GROUP_PER_MINUTE)
+
+def _record_sent(endpoint, data, result):
+    # the bot's own messages are purgeable too
+    if isinstance(result, dict) and "message_id" in result and "chat" in result:
+        msg_index.add(result["chat"]["id"], result["message_id"])
+
+api_limiter.observers.append(_record_sent)
+application = (ApplicationBuilder().token(TOKEN).base_url(f"{API_BASE}/bot").base_file_url(f"{API_BASE}/file/bot")
+               .rate_limiter(api_limiter).build())
 
 # register handlers
+# group -1 runs ahead of everything else: remember message ids for /purge
+application.add_handler(MessageHandler(filters.ALL, track_message), group=-1)
 application.add_handler(CommandHandler("start", start_cmd))
 application.add_handler(CallbackQueryHandler(cb_help, pattern="^(help:|rules)"))
 
@@ -694,10 +1207,12 @@ application.add_handler(CallbackQueryHandler(cb_help, pattern="^(help:|rules)"))
 application.add_handler(CommandHandler("bansticker", bansticker))
 application.add_handler(CommandHandler("allowsticker", allowsticker))
 application.add_handler(CommandHandler("liststickers", liststickers))
+application.add_handler(CommandHandler("banpack", banpack))
+application.add_handler(CommandHandler("allowpack", allowpack))
 
 # q & kang
-application.add_handler(CommandHandler("q", q_cmd))
-application.add_handler(CommandHandler("kang", kang_cmd))
+application.add_handler(CommandHandler("q", q_cmd, block=False))
+application.add_handler(CommandHandler("kang", kang_cmd, block=False))
 
 # moderation
 application.add_handler(CommandHandler("warn", warn_cmd))
@@ -714,6 +1229,9 @@ application.add_handler(CommandHandler("rules", rules_cmd))
 application.add_handler(CommandHandler("antilink", antilink_cmd))
 application.add_handler(CommandHandler("setwelcome", setwelcome_cmd))
 application.add_handler(CommandHandler("welcome", welcome_toggle))
+application.add_handler(CommandHandler("flood", flood_cmd))
+application.add_handler(CommandHandler(["filter", "unfilter"], filter_cmd))
+application.add_handler(CommandHandler("filters", filters_cmd))
 
 # notes
 application.add_handler(CommandHandler("setnote", setnote_cmd))
@@ -725,6 +1243,9 @@ application.add_handler(CommandHandler("listnotes", listnotes_cmd))
 application.add_handler(CommandHandler("react", react_cmd))
 application.add_handler(CommandHandler("info", info_cmd))
 
+# operator
+application.add_handler(CommandHandler("profile", profile_cmd))
+
 # group utilities
 application.add_handler(CommandHandler("all", all_cmd))
 application.add_handler(CommandHandler("pin", pin_cmd))
@@ -735,16 +1256,104 @@ application.add_handler(CommandHandler("unlock", unlock_cmd))
 
 # events
 application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_member))
+application.add_handler(ChatMemberHandler(track_admins, ChatMemberHandler.ANY_CHAT_MEMBER))
 
 # catch-all
 application.add_handler(MessageHandler(filters.ALL & (~filters.COMMAND), msg_handler))
 
 # initialize DB
 init_db()
+atexit.register(db.close)
+atexit.register(members_wb.close)
+atexit.register(converter.close)
+
+# updates run on a single long-lived event loop owned by the ingestor
+ingestor = UpdateIngestor(application, queue_size=INGEST_QUEUE_SIZE, workers=INGEST_WORKERS,
+                          ordered=INGEST_ORDERED, put_timeout=INGEST_PUT_TIMEOUT)
+ingestor.on_start.append(lambda: flood.run_sweeper(time.time, FLOOD_SWEEP_INTERVAL))
+ingestor.on_start.append(state.run_sweeper)
+ingestor.on_start.append(prune_members)
+if router.enabled or state.shared:
+    ingestor.on_start.append(sync_sticker_index)
+atexit.register(state.close)
+atexit.register(ingestor.stop)
+dedup = UpdateDedup(DEDUP_WINDOW)
+ingestor.on_processed.append(lambda upd: dedup.done(upd.update_id))
+
+# ------------- TRACING / PROFILING -------------
+tracer = tracing.UpdateTracer(slow_ms=SLOW_UPDATE_MS)
+ingestor.trace = tracer.trace
+db.timers.append(lambda op, el: tracing.record("db " + op, el))
+api_limiter.timers.append(lambda method, el, ok: tracing.record("api " + method, el))
+converter.timers.append(lambda job, el, outcome: tracing.record("convert " + job, el))
+profiler = tracing.SamplingProfiler(PROFILE_INTERVAL, PROFILE_PATH)
+if PROFILE:
+    profiler.start()
+atexit.register(profiler.stop)
+
+# ------------- METRICS -------------
+# always-on histograms/counters, scraped as Prometheus text from /metrics
+registry = metrics.Registry()
+handler_seconds = registry.histogram("bot_handler_seconds", "Handler callback latency", ["handler"])
+handler_errors = registry.counter("bot_handler_errors_total", "Handler callbacks that raised", ["handler"])
+db_seconds = registry.histogram("bot_db_seconds", "DB call latency including executor wait", ["op"])
+api_seconds = registry.histogram("bot_api_seconds", "Bot API call latency", ["method", "ok"])
+convert_seconds = registry.histogram("bot_convert_seconds", "Image conversion wall time", ["job", "outcome"])
+metrics.instrument_handlers(application, handler_seconds, handler_errors)
+db.timers.append(lambda op, el: db_seconds.observe(el, op))
+api_limiter.timers.append(lambda method, el, ok: api_seconds.observe(el, method, "1" if ok else "0"))
+converter.timers.append(lambda job, el, outcome: convert_seconds.observe(el, job, outcome))
+registry.counter_fn("bot_updates_total", "Updates by ingestion outcome",
+                    lambda: dict(ingestor.stats), ["outcome"])
+registry.counter_fn("bot_replies_total", "Background replies by outcome", lambda: dict(say_stats), ["outcome"])
+registry.counter_fn("bot_dedup_total", "Webhook deliveries by dedup outcome", lambda: dict(dedup.stats), ["outcome"])
+registry.counter_fn("bot_shard_updates_total", "Webhook updates forwarded to their owning shard",
+                    lambda: dict(router.stats), ["outcome"])
+registry.gauge("bot_queue_depth", "Work waiting or in flight",
+               lambda: {"ingest": ingestor.depth(), "convert": converter.depth(), "api": api_limiter.depth()},
+               ["queue"])
+registry.gauge("bot_cache_hit_ratio", "Hit ratio per in-memory cache",
+               lambda: {"settings": settings_cache.stats()["hit_rate"], "admins": admin_cache.stats()["hit_rate"],
+                        "stickers": sticker_cache.stats()["hit_rate"], "notes": note_index.values.stats()["hit_rate"],
+                        "filters": filter_engine.stats()["cache"]["hit_rate"]}, ["cache"])
+registry.gauge("bot_cache_entries", "Entries per in-memory cache",
+               lambda: {"settings": len(settings_cache), "admins": admin_cache.stats()["size"],
+                        "flood": flood.tracked(), "sticker_bans": len(sticker_index),
+                        "mention_pages": len(mention_pages), "sticker_packs": len(sticker_packs)}, ["cache"])
 
 # ------------- FLASK APP (webhook receiver) -------------
 flask_app = Flask(__name__)
 
+
+def claim_update(update_id):
+    """False if this update_id was already taken here (or, with a shared state
+    backend, by any process within DEDUP_TTL)."""
+    if not dedup.claim(update_id):
+        return False
+    if state.shared:
+        try:
+            fresh = ingestor.run(state.mark(f"upd:{update_id}", DEDUP_TTL), INGEST_PUT_TIMEOUT)
+        except Exception:
+            # can't tell; process it rather than risk dropping it
+            log.warning("Dedup marker for update %s failed; processing anyway.", update_id)
+            return True
+        if not fresh:
+            dedup.done(update_id)
+            return False
+    return True
+
+
+def release_update(update_id):
+    # the update was refused, so its redelivery must run
+    if update_id is None:
+        return
+    dedup.release(update_id)
+    if state.shared:
+        try:
+            ingestor.run(state.delete(f"upd:{update_id}"), INGEST_PUT_TIMEOUT)
+        except Exception:
+            log.warning("Could not clear dedup marker for update %s.", update_id)
+
 @flask_app.post("/")
 def receive_update():
     if application is None or TOKEN is None:
@@ -752,50 +1361,67 @@ def receive_update():
     data = request.get_json(force=True)
     if not data:
         return "no data", 400
+    # another worker owns this chat: hand the raw body over (forwarded requests are never re-routed)
+    if router.enabled and router.FORWARD_HEADER not in request.headers:
+        owner = router.owner(data)
+        if owner != router.index:
+            return "OK" if router.forward(owner, request.get_data()) else ("shard unavailable", 503)
+    # a redelivery of an update already in flight or done is acknowledged, not re-run
+    update_id = data.get("update_id")
+    if update_id is not None and not claim_update(update_id):
+        return "OK"
     upd = Update.de_json(data, application.bot)
-    # process in background
+    # hand off to the bot loop and acknowledge right away; a full queue makes
+    # Telegram retry later instead of piling more work on
     try:
-        asyncio.create_task(application.process_update(upd))
-    except RuntimeError:
-        # no running loop (gunicorn sync worker) -> run new loop briefly
-        asyncio.run(application.process_update(upd))
+        ingestor.submit(upd)
+    except QueueFull:
+        release_update(update_id)
+        return "busy", 503
     return "OK"
 
+@flask_app.get("/metrics")
+def metrics_view():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
 @flask_app.get("/")
 def home():
     return "Webhook bot running."
 
-# a helper to set webhook once at startup (synchronous call to Telegram API)
-def set_webhook():
-    if not TOKEN:
-        log.error("TELEGRAM_BOT_TOKEN not set. Webhook won't be registered.")
-        return False
+# webhook registration runs on the bot loop once the app is up, so importing
+# this module (and gunicorn accepting traffic) never waits on Telegram
+async def register_webhook(delay=2.0):
     if not PUBLIC_URL:
-        log.warning("PUBLIC_URL (RENDER_EXTERNAL_URL or WEBHOOK_URL) not set. Please set WEBHOOK_URL env or rely on Render's external url.")
-        # still try to set to empty -> will fail
-    hook = (PUBLIC_URL.rstrip("/") if PUBLIC_URL else "") + "/"
-    try:
-        # set webhook using the bot's API method (async) by using requests to avoid async complexity
-        import requests
-        url = f"https://api.telegram.org/bot{TOKEN}/setWebhook"
-        resp = requests.post(url, json={"url": hook, "allowed_updates": []}, timeout=15)
-        if resp.ok:
+        log.warning("PUBLIC_URL (RENDER_EXTERNAL_URL or WEBHOOK_URL) not set. Webhook won't be registered.")
+        return False
+    hook = PUBLIC_URL.rstrip("/") + "/"
+    while True:
+        try:
+            await ingestor.initialize()
+            info = await application.bot.get_webhook_info()
+            if info.url == hook and set(info.allowed_updates or ()) == set(Update.ALL_TYPES):
+                log.info("Webhook already set to %s", hook)
+                return True
+            await application.bot.set_webhook(hook, allowed_updates=Update.ALL_TYPES)
             log.info("Webhook set to %s", hook)
             return True
-        else:
-            log.error("Failed to set webhook: %s %s", resp.status_code, resp.text)
-            return False
-    except Exception as e:
-        log.exception("Exception setting webhook: %s", e)
-        return False
-
-# set webhook when module is loaded (Render import)
-try:
-    ok = set_webhook()
-    if not ok:
-        log.warning("Webhook registration did not succeed. Check WEBHOOK_URL / PUBLIC_URL env.")
-except Exception:
-    log.exception("Webhook registration failed.")
+        except Exception as e:
+            log.warning("Webhook registration failed (%s); retrying in %.0fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 300.0)
+
+# sharded: listen for updates forwarded by the other workers
+if router.enabled:
+    router.serve(flask_app, SHARD_LISTEN, SHARD_PORT_BASE + SHARD_INDEX)
+
+# start the bot loop in the background (BOT_AUTOSTART=0 leaves it to the caller,
+# e.g. benchmarks/replay.py); one webhook registration is enough
+if TOKEN and os.environ.get("BOT_AUTOSTART", "1") == "1":
+    if SHARD_INDEX == 0:
+        ingestor.on_start.append(register_webhook)
+    ingestor.start()
+elif not TOKEN:
+    log.error("TELEGRAM_BOT_TOKEN not set. Webhook won't be registered.")
 
 # expose Flask app variable for gunicorn
 app = flask_app
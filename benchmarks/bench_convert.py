@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# bench_convert.py
+# Latency seen by "other chats" while /q is hammered: a ticker task stands in
+# for unrelated handlers and records how late each 10ms tick fires, with
+# conversions run inline on the loop vs through the ConversionService pool.
+#
+#   python benchmarks/bench_convert.py [--jobs 24] [--concurrency 8] [--size 2400x1800]
+
+import io
+import sys
+import time
+import random
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import imaging  # noqa: E402
+from convert import ConversionService  # noqa: E402
+from PIL import Image  # noqa: E402
+
+
+def make_photo(w, h, seed=1):
+    rnd = random.Random(seed)
+    img = Image.frombytes("RGB", (w, h), rnd.randbytes(w * h * 3))
+    bio = io.BytesIO(); img.save(bio, "JPEG", quality=90)
+    return bio.getvalue()
+
+
+def pct(vals, p):
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(len(vals) * p))]
+
+
+async def ticker(stop, lags, period=0.01):
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(period)
+        lags.append(time.perf_counter() - t - period)
+
+
+async def scenario(convert, raw, jobs, concurrency):
+    stop = asyncio.Event(); lags = []
+    tick = asyncio.create_task(ticker(stop, lags))
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await convert(raw)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(jobs)))
+    elapsed = time.perf_counter() - t0
+    stop.set(); await tick
+    return elapsed, lags
+
+
+def report(name, jobs, elapsed, lags):
+    print(f"{name:7}: {jobs/elapsed:6.1f} conv/s | other-chat lag p50 {pct(lags,.5)*1000:6.1f} ms "
+          f"p99 {pct(lags,.99)*1000:6.1f} ms max {max(lags)*1000:6.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=24)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--size", default="2400x1800")
+    args = ap.parse_args()
+    w, h = map(int, args.size.split("x"))
+    raw = make_photo(w, h)
+
+    async def inline(data):
+        return imaging.convert_image(data)
+
+    el, lags = asyncio.run(scenario(inline, raw, args.jobs, args.concurrency))
+    report("inline", args.jobs, el, lags)
+
+    svc = ConversionService(workers=args.workers, max_pending=args.jobs, timeout=60)
+
+    async def pooled(data):
+        return await svc.run(imaging.convert_image, data)
+
+    async def run_pooled():
+        await svc.run(imaging.convert_image, make_photo(64, 64))  # warm the pool
+        return await scenario(pooled, raw, args.jobs, args.concurrency)
+
+    try:
+        el, lags = asyncio.run(run_pooled())
+    finally:
+        svc.close()
+    report("pool", args.jobs, el, lags)
+
+
+if __name__ == "__main__":
+    main()
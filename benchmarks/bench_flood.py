@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# bench_flood.py
+# Flood-control microbenchmark with millions of synthetic users: hits/sec,
+# memory held, and sweep cost for the legacy dict-of-lists vs FloodControl.
+# A share of the traffic comes from spammers posting in bursts, and both
+# engines must flag exactly the same floods.
+#
+#   python benchmarks/bench_flood.py [--users 1000000] [--chats 1000] [--hits 3000000] [--spam 0.05]
+
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from flood import FloodControl  # noqa: E402
+
+LIMIT, WINDOW = 6, 6.0
+
+
+def workload(users, chats, hits, spam=0.05, spammers=200, seed=1):
+    rnd = random.Random(seed)
+    # (chat, user, timestamp): ~1000 msg/s of simulated wall time; a `spam` share
+    # comes from a few spammers, each hammering one chat at about 8 msg/s
+    bots = [(rnd.randrange(chats), users + i) for i in range(spammers)]
+    out = []
+    for i in range(hits):
+        if rnd.random() < spam:
+            chat, uid = bots[(i // 40) % spammers]
+        else:
+            chat, uid = rnd.randrange(chats), rnd.randrange(users)
+        out.append((chat, uid, i / 1000.0))
+    return out
+
+
+def legacy(events):
+    recent = {}
+    flagged = 0
+    for chat, uid, now in events:
+        d = recent.setdefault(chat, {}).setdefault(uid, [])
+        d[:] = [x for x in d if x > now - WINDOW]
+        d.append(now)
+        if len(d) >= LIMIT:
+            flagged += 1; d.clear()
+    return recent, flagged
+
+
+def ring(events, sweep_every=30.0):
+    # sweeps at the bot's default FLOOD_SWEEP_INTERVAL of simulated time
+    fc = FloodControl(LIMIT, WINDOW)
+    flagged = 0
+    hit = fc.hit
+    next_sweep = sweep_every
+    for chat, uid, now in events:
+        if hit(chat, uid, now):
+            flagged += 1; fc.reset(chat, uid)
+        if now >= next_sweep:
+            fc.sweep(now); next_sweep = now + sweep_every
+    return fc, flagged
+
+
+def measure(fn, events):
+    # timed without tracemalloc (it taxes every allocation), then re-run for memory
+    t0 = time.perf_counter()
+    fn(events)
+    el = time.perf_counter() - t0
+    tracemalloc.start()
+    state, flagged = fn(events)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return state, flagged, el, held
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--chats", type=int, default=1000)
+    ap.add_argument("--hits", type=int, default=3_000_000)
+    ap.add_argument("--spam", type=float, default=0.05, help="share of messages sent by burst spammers")
+    args = ap.parse_args()
+    events = workload(args.users, args.chats, args.hits, args.spam)
+    end = events[-1][2]
+
+    _, fl, el, held = measure(legacy, events)
+    print(f"legacy : {len(events)/el:10.0f} hits/s  flagged={fl}  held={held/2**20:7.1f} MiB (never evicted)")
+
+    fc, fr, er, held = measure(ring, events)
+    print(f"ring   : {len(events)/er:10.0f} hits/s  flagged={fr}  held={held/2**20:7.1f} MiB  "
+          f"tracked={fc.tracked()}  footprint()={fc.memory_footprint()/2**20:.1f} MiB (swept every 30s)")
+    if fr != fl:
+        print(f"MISMATCH: ring flagged {fr} floods, legacy {fl}")
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    dropped = fc.sweep(end)
+    print(f"sweep  : dropped {dropped} idle users in {(time.perf_counter()-t0)*1000:.0f} ms, "
+          f"left {fc.tracked()} ({fc.memory_footprint()/2**20:.2f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# bench_media.py
+# Peak RSS of one /q image conversion, each variant in a fresh process (Linux):
+#   legacy   - largest PhotoSize, full decode + convert("RGBA") + resize
+#   draft    - same source through imaging.convert_image (JPEG draft decode)
+#   picked   - the ~1280px PhotoSize media.pick_photo would choose, via imaging
+#
+#   python benchmarks/bench_media.py [--size 4000x3000]
+
+import os
+import sys
+import random
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHILD = r"""
+import io, sys, time
+sys.path.insert(0, {root!r})
+from PIL import Image
+import imaging
+
+def status(field):
+    for line in open("/proc/self/status"):
+        if line.startswith(field):
+            return int(line.split()[1])
+
+data = open({path!r}, "rb").read()
+open("/proc/self/clear_refs", "w").write("5")  # reset the peak-RSS watermark
+base = status("VmRSS:")
+t = time.perf_counter()
+if {variant!r} == "legacy":
+    img = Image.open(io.BytesIO(data)).convert("RGBA")
+    w, h = img.size; s = min(512 / w, 512 / h, 1)
+    img = img.resize((int(w * s), int(h * s)), Image.LANCZOS)
+    canvas = Image.new("RGBA", (512, 512), (0, 0, 0, 0)); canvas.paste(img, (0, 0), img)
+    out = io.BytesIO(); canvas.save(out, "WEBP", lossless=True)
+else:
+    imaging.convert_image(data)
+el = time.perf_counter() - t
+print(status("VmHWM:") - base, el)
+"""
+
+
+def make_jpeg(w, h, path, seed=1):
+    from PIL import Image
+    rnd = random.Random(seed)
+    # smooth-ish content so JPEG size is realistic for a photo
+    small = Image.frombytes("RGB", (w // 16, h // 16), rnd.randbytes((w // 16) * (h // 16) * 3))
+    small.resize((w, h), Image.BICUBIC).save(path, "JPEG", quality=88)
+
+
+def run(variant, path):
+    code = CHILD.format(root=str(ROOT), path=path, variant=variant)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+    return int(out[0]) / 1024, float(out[1]) * 1000  # /proc/self/status reports KiB
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size", default="4000x3000")
+    args = ap.parse_args()
+    w, h = map(int, args.size.split("x"))
+    with tempfile.TemporaryDirectory() as tmp:
+        big = os.path.join(tmp, "big.jpg"); make_jpeg(w, h, big)
+        picked = os.path.join(tmp, "picked.jpg"); make_jpeg(1280, int(1280 * h / w), picked)
+        for name, variant, path in (("legacy", "legacy", big), ("draft", "new", big), ("picked", "new", picked)):
+            mib, ms = run(variant, path)
+            print(f"{name:7}: peak RSS above baseline {mib:7.1f} MiB  ({ms:6.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
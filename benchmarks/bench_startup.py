@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# bench_startup.py
+# Cold-start time of a worker against the stub Bot API from replay.py:
+# process launch -> `import advanced_bot_full` returned (gunicorn can serve),
+# and -> webhook confirmed (setWebhook, or getWebhookInfo already matching).
+# Also checks that Pillow and requests stay off the startup path.
+#
+#   python benchmarks/bench_startup.py [--runs 5] [--target-ms 1000]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+from replay import StubAPI, serve_stub, TOKEN  # noqa: E402
+
+CHILD = """
+import sys, time, json
+t0 = time.perf_counter()
+import advanced_bot_full
+print(json.dumps({"import_ms": (time.perf_counter() - t0) * 1000,
+                  "pil": "PIL" in sys.modules, "requests": "requests" in sys.modules}), flush=True)
+time.sleep(60)
+"""
+
+
+def run_once(api, env, workdir, wait=30.0):
+    api.events.clear()
+    t0 = time.perf_counter()
+    child = subprocess.Popen([sys.executable, "-c", CHILD], env=env, cwd=workdir,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        line = child.stdout.readline()
+        serving = (time.perf_counter() - t0) * 1000
+        info = json.loads(line)
+        deadline = time.perf_counter() + wait
+        ready = None
+        while time.perf_counter() < deadline:
+            done = [ts for ts, m in api.events if m == "setWebhook"]
+            if not done and api.webhook["url"] and any(m == "getWebhookInfo" for _, m in api.events):
+                done = [ts for ts, m in api.events if m == "getWebhookInfo"]
+            if done:
+                ready = (done[0] - t0) * 1000
+                break
+            time.sleep(0.005)
+        return serving, info, ready, [m for _, m in api.events]
+    finally:
+        child.kill()
+        child.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--target-ms", type=float, default=1000.0, help="fail if median time-to-serving exceeds this")
+    args = ap.parse_args()
+
+    api = StubAPI()
+    server = serve_stub(api)
+    env = dict(os.environ, TELEGRAM_BOT_TOKEN=TOKEN, TELEGRAM_API_BASE=f"http://127.0.0.1:{server.server_port}",
+               WEBHOOK_URL="https://bot.example/", PYTHONPATH=str(HERE.parent))
+    workdir = tempfile.mkdtemp(prefix="startup-")
+
+    serving, ready = [], []
+    for i in range(args.runs):
+        s, info, r, calls = run_once(api, env, workdir)
+        serving.append(s)
+        if r is not None:
+            ready.append(r)
+        print(f"run {i}: serving after {s:6.0f} ms (import {info['import_ms']:5.0f} ms), "
+              f"webhook {'%6.0f ms' % r if r is not None else 'not confirmed'} via {'/'.join(calls) or '-'}; "
+              f"PIL loaded={info['pil']} requests loaded={info['requests']}")
+
+    med = statistics.median(serving)
+    print(f"median: serving {med:.0f} ms, webhook confirmed "
+          f"{statistics.median(ready):.0f} ms" if ready else f"median: serving {med:.0f} ms")
+    server.shutdown()
+    if med > args.target_ms:
+        print(f"FAIL: median cold start {med:.0f} ms exceeds target {args.target_ms:.0f} ms")
+        sys.exit(1)
+    print(f"OK: within target {args.target_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# bench_storage.py
+# Messages/sec for the per-message DB work done by msg_handler/auto_mod:
+# legacy connect-per-call helpers vs the pooled Storage executor.
+#
+#   python benchmarks/bench_storage.py [--messages 5000] [--concurrency 50]
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from storage import Storage  # noqa: E402
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS banned_stickers (file_unique_id TEXT UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS settings (chat_id INTEGER, key TEXT, value TEXT, PRIMARY KEY(chat_id,key))",
+    "CREATE TABLE IF NOT EXISTS members (chat_id INTEGER, user_id INTEGER, name TEXT, PRIMARY KEY(chat_id,user_id))",
+)
+
+
+def make_db(path):
+    con = sqlite3.connect(path)
+    for stmt in SCHEMA:
+        con.execute(stmt)
+    con.executemany("INSERT OR REPLACE INTO settings VALUES (?,?,?)", [(c, "antilink", "on") for c in range(100)])
+    con.executemany("INSERT OR IGNORE INTO banned_stickers VALUES (?)", [(f"sticker{i}",) for i in range(50)])
+    con.commit(); con.close()
+
+
+def workload(n, seed=1):
+    rnd = random.Random(seed)
+    return [(rnd.randrange(100), rnd.randrange(5000), f"sticker{rnd.randrange(200)}") for _ in range(n)]
+
+
+# -- legacy helpers (as they were in advanced_bot_full.py) --
+def legacy_add_seen_member(path, chat_id, user_id, name):
+    con = sqlite3.connect(path); cur = con.cursor()
+    cur.execute("INSERT OR REPLACE INTO members VALUES (?,?,?)", (chat_id, user_id, name))
+    con.commit(); con.close()
+
+def legacy_get_setting(path, chat_id, key):
+    con = sqlite3.connect(path); cur = con.cursor()
+    cur.execute("SELECT value FROM settings WHERE chat_id=? AND key=?", (chat_id, key))
+    r = cur.fetchone(); con.close()
+    return r[0] if r else None
+
+def legacy_is_banned(path, uid):
+    con = sqlite3.connect(path); cur = con.cursor()
+    cur.execute("SELECT 1 FROM banned_stickers WHERE file_unique_id=?", (uid,))
+    r = cur.fetchone(); con.close()
+    return bool(r)
+
+
+async def run_legacy(path, msgs, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(chat, uid, sticker):
+        async with sem:
+            legacy_add_seen_member(path, chat, uid, f"user{uid}")
+            legacy_get_setting(path, chat, "antilink")
+            legacy_is_banned(path, sticker)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(one(*m) for m in msgs))
+
+
+async def run_pooled(db, msgs, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(chat, uid, sticker):
+        async with sem:
+            await db.execute("INSERT OR REPLACE INTO members VALUES (?,?,?)", (chat, uid, f"user{uid}"))
+            await db.fetchone("SELECT value FROM settings WHERE chat_id=? AND key=?", (chat, "antilink"))
+            await db.fetchone("SELECT 1 FROM banned_stickers WHERE file_unique_id=?", (sticker,))
+
+    await asyncio.gather(*(one(*m) for m in msgs))
+
+
+async def loop_lag(stop):
+    # worst observed scheduling delay of a 1ms ticker while the workload runs
+    worst = 0.0
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - t - 0.001)
+    return worst
+
+
+async def measure(coro):
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    t0 = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    return elapsed, await lag
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--workers", type=int, default=2)
+    args = ap.parse_args()
+    msgs = workload(args.messages)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+        make_db(legacy_path); make_db(pooled_path)
+
+        el, lag = asyncio.run(measure(run_legacy(legacy_path, msgs, args.concurrency)))
+        print(f"legacy  : {len(msgs)/el:9.0f} msg/s  ({el:.2f}s, max loop lag {lag*1000:.1f} ms)")
+
+        db = Storage(pooled_path, workers=args.workers)
+        try:
+            ep, lag = asyncio.run(measure(run_pooled(db, msgs, args.concurrency)))
+        finally:
+            db.close()
+        print(f"pooled  : {len(msgs)/ep:9.0f} msg/s  ({ep:.2f}s, max loop lag {lag*1000:.1f} ms)")
+        print(f"speedup : {el/ep:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# bench_text.py
+# /q text rendering over a corpus of short and long messages: the original
+# per-call font loading + per-word textbbox wrap vs imaging's cached-metrics
+# layout. Layout-only and full render (incl. WEBP encode) are timed separately.
+#
+#   python benchmarks/bench_text.py [--rounds 3]
+
+import io
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import imaging  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+WORDS = ("the quick brown fox jumps over lazy dog telegram sticker quote meme admin "
+         "please stop spamming this group thanks everyone hello world lol ok").split()
+
+
+def corpus(seed=1):
+    rnd = random.Random(seed)
+    short = [" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 8))) for _ in range(60)]
+    long = [" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(40, 160))) for _ in range(20)]
+    return short, long
+
+
+def legacy_layout(text):
+    # layout portion of the original text_to_webp_image
+    max_dim = 512
+    canvas = Image.new("RGBA", (max_dim, max_dim), (0,0,0,0))
+    draw = ImageDraw.Draw(canvas)
+    font = None
+    for fpath in imaging.FONT_PATHS:
+        try:
+            font = ImageFont.truetype(fpath, 36); break
+        except Exception:
+            font = None
+    if not font:
+        font = ImageFont.load_default()
+    words = text.split()
+    lines = []; cur = ""
+    for w in words:
+        test = (cur + " " + w).strip()
+        bbox = draw.textbbox((0,0), test, font=font)
+        if bbox[2] > max_dim - 40 and cur:
+            lines.append(cur); cur = w
+        else:
+            cur = test
+    if cur: lines.append(cur)
+    heights = [draw.textbbox((0,0), ln, font=font)[3] - draw.textbbox((0,0), ln, font=font)[1] for ln in lines]
+    widths = [draw.textbbox((0,0), ln, font=font) for ln in lines]
+    return canvas, draw, font, lines, heights, widths
+
+
+def legacy_render(text):
+    canvas, draw, font, lines, heights, widths = legacy_layout(text)
+    total_h = sum(heights) + (len(lines)-1)*6
+    y = (512 - total_h)//2
+    for ln, lh, bbox in zip(lines, heights, widths):
+        draw.text(((512 - (bbox[2]-bbox[0]))//2, y), ln, font=font, fill=(255,255,255,255))
+        y += lh + 6
+    out = io.BytesIO(); canvas.save(out, "WEBP", lossless=True)
+    return out.getvalue()
+
+
+def overflow(text):
+    # does the legacy fixed-36px layout spill off the 512px canvas?
+    _, _, _, lines, heights, _ = legacy_layout(text)
+    return sum(heights) + (len(lines)-1)*6 > 512
+
+
+def bench(fn, texts, rounds):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for t in texts:
+            fn(t)
+    return (time.perf_counter() - t0) / (rounds * len(texts)) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+    short, long = corpus()
+    imaging.fit_text("warm up")
+
+    for name, texts in (("short", short), ("long", long)):
+        lay_old = bench(legacy_layout, texts, args.rounds)
+        lay_new = bench(imaging.fit_text, texts, args.rounds)
+        ren_old = bench(legacy_render, texts, args.rounds)
+        ren_new = bench(imaging.render_text, texts, args.rounds)
+        spill = sum(map(overflow, texts))
+        print(f"{name:5} ({len(texts)} msgs): layout {lay_old:7.2f} -> {lay_new:6.2f} ms | "
+              f"render+encode {ren_old:7.2f} -> {ren_new:6.2f} ms | legacy overflowed {spill}/{len(texts)}")
+
+
+if __name__ == "__main__":
+    main()
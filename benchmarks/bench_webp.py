@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# bench_webp.py
+# WEBP encode time and output size for photo, screenshot and text stickers:
+# the old always-lossless save vs imaging.encode_webp under each profile.
+# Sizes over Telegram's 512 KB sticker limit are flagged.
+#
+#   python benchmarks/bench_webp.py [--rounds 3]
+
+import io
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import imaging  # noqa: E402
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+
+def photo(seed=1):
+    rnd = random.Random(seed)
+    base = Image.frombytes("RGB", (48, 36), rnd.randbytes(48 * 36 * 3)).resize((1600, 1200), Image.BICUBIC)
+    grain = Image.frombytes("RGB", (1600, 1200), rnd.randbytes(1600 * 1200 * 3)).filter(ImageFilter.GaussianBlur(1))
+    img = Image.blend(base, grain, 0.25)
+    bio = io.BytesIO(); img.save(bio, "JPEG", quality=90)
+    return imaging.prepare_image(bio.getvalue())
+
+
+def screenshot(seed=2):
+    rnd = random.Random(seed)
+    img = Image.new("RGB", (1080, 1920), (245, 245, 245))
+    d = ImageDraw.Draw(img)
+    y = 40
+    while y < 1880:
+        h = rnd.randint(60, 180)
+        d.rounded_rectangle((30, y, 1050, y + h), 20, fill=rnd.choice([(255, 255, 255), (220, 248, 198)]))
+        d.text((60, y + 20), "message " * rnd.randint(2, 8), fill=(20, 20, 20))
+        y += h + 20
+    bio = io.BytesIO(); img.save(bio, "PNG")
+    return imaging.prepare_image(bio.getvalue())
+
+
+def text():
+    return imaging.render_text_image("this is a fairly long quote that somebody said in the group " * 3)
+
+
+def legacy(img):
+    # the old path: lossless on a padded 512x512 canvas
+    canvas = Image.new("RGBA", (512, 512), (0, 0, 0, 0))
+    canvas.paste(img, ((512 - img.width) // 2, (512 - img.height) // 2), img)
+    out = io.BytesIO(); canvas.save(out, "WEBP", lossless=True)
+    return out.getvalue(), {"mode": "lossless", "quality": None}
+
+
+def timed(fn, rounds):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        data, info = fn()
+    return data, info, (time.perf_counter() - t0) / rounds * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+    inputs = {"photo": photo(), "screenshot": screenshot(), "text": text()}
+    print(f"{'input':11} {'encoder':9} {'mode':9} {'q':>3} {'KB':>7} {'ms':>7}")
+    for name, img in inputs.items():
+        rows = [("legacy", lambda: legacy(img))]
+        lossless = True if name == "text" else None
+        for prof in imaging.PROFILES:
+            rows.append((prof, lambda prof=prof: imaging.encode_webp(img, lossless=lossless, profile=prof)))
+        for enc, fn in rows:
+            data, info, ms = timed(fn, args.rounds)
+            flag = "  OVER LIMIT" if len(data) > imaging.STICKER_MAX_BYTES else ""
+            print(f"{name:11} {enc:9} {info['mode']:9} {info['quality'] or '-':>3} {len(data)/1024:7.1f} {ms:7.1f}{flag}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# replay.py
+# Offline end-to-end benchmark: replays synthetic (or recorded) update JSON
+# through Update.de_json + application.process_update against a local stub
+# Bot API server, so the whole bot can be measured without network access.
+# Reports updates/sec, per-handler p50/p99, DB calls and Bot API calls per
+# update, and peak RSS; --json/--baseline save and compare runs.
+#
+#   python benchmarks/replay.py [--updates 5000] [--concurrency 16] [--chats 50]
+#   python benchmarks/replay.py --record updates.jsonl        # replay recorded updates (one JSON per line)
+#   python benchmarks/replay.py --json run.json --baseline base.json
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import email
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import itertools
+import threading
+from collections import Counter, defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+TOKEN = "123456:REPLAY"
+BOT = {"id": 123456, "is_bot": True, "first_name": "Replay", "username": "replay_bot",
+       "can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False}
+ADMIN_ID = 1
+
+
+# ------------- stub Bot API -------------
+def _user(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"user{uid}"}
+
+
+def _chat(chat_id):
+    return {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup", "title": f"chat{chat_id}"}
+
+
+def _png(size=(640, 480)):
+    from PIL import Image
+    img = Image.radial_gradient("L").resize(size).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+class StubError(Exception):
+    """Answered as {"ok": false} with this description (Telegram's 400 Bad Request)."""
+
+
+class StubAPI:
+    def __init__(self):
+        self.calls = Counter()
+        self.image = _png()
+        self._ids = itertools.count(10_000_000)
+        self._lock = threading.Lock()
+        self.webhook = {"url": "", "allowed_updates": None}
+        self.events = []  # (perf_counter, method) of webhook calls, for bench_startup.py
+        self.sticker_sets = {}  # name -> sticker count
+
+    def _message(self, params, **extra):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        with self._lock:
+            mid = next(self._ids)
+        return {"message_id": mid, "date": int(time.time()), "chat": _chat(chat_id), "from": BOT, **extra}
+
+    def answer(self, method, params):
+        with self._lock:
+            self.calls[method] += 1
+        if method == "getMe":
+            return BOT
+        if method == "getWebhookInfo":
+            self.events.append((time.perf_counter(), method))
+            return {**self.webhook, "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "setWebhook":
+            allowed = params.get("allowed_updates")
+            self.webhook = {"url": params.get("url", ""),
+                            "allowed_updates": json.loads(allowed) if isinstance(allowed, str) else allowed}
+            self.events.append((time.perf_counter(), method))
+            return True
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if method == "sendSticker":
+            fid = f"stk{next(self._ids)}"
+            return self._message(params, sticker={"file_id": fid, "file_unique_id": "u" + fid, "type": "regular",
+                                                  "width": 512, "height": 512, "is_animated": False, "is_video": False})
+        if method.startswith(("send", "copy", "forward")):
+            return self._message(params)
+        if method == "getChatMember":
+            uid = int(params.get("user_id", 0))
+            if uid == ADMIN_ID:
+                return {"status": "creator", "user": _user(uid), "is_anonymous": False}
+            return {"status": "member", "user": _user(uid)}
+        if method == "getChatAdministrators":
+            return [{"status": "creator", "user": _user(ADMIN_ID), "is_anonymous": False}]
+        if method == "getChat":
+            return _chat(int(params.get("chat_id", 0)))
+        if method == "getFile":
+            fid = params.get("file_id", "f")
+            return {"file_id": fid, "file_unique_id": "u" + fid, "file_size": len(self.image), "file_path": f"photos/{fid}.png"}
+        if method == "uploadStickerFile":
+            fid = f"up{next(self._ids)}"
+            return {"file_id": fid, "file_unique_id": "u" + fid, "file_size": 1}
+        if method == "createNewStickerSet":
+            with self._lock:
+                if params["name"] in self.sticker_sets:
+                    raise StubError("Bad Request: sticker set name is already occupied")
+                self.sticker_sets[params["name"]] = 1
+            return True
+        if method == "addStickerToSet":
+            with self._lock:
+                count = self.sticker_sets.get(params["name"])
+                if count is None:
+                    raise StubError("Bad Request: STICKERSET_INVALID")
+                if count >= 120:
+                    raise StubError("Bad Request: STICKERS_TOO_MUCH")
+                self.sticker_sets[params["name"]] = count + 1
+            return True
+        if method == "getStickerSet":
+            count = self.sticker_sets.get(params["name"])
+            if count is None:
+                raise StubError("Bad Request: STICKERSET_INVALID")
+            return {"name": params["name"], "title": params["name"], "sticker_type": "regular",
+                    "is_animated": False, "is_video": False,
+                    "stickers": [{"file_id": f"{params['name']}{i}", "file_unique_id": f"u{params['name']}{i}",
+                                  "type": "regular", "width": 512, "height": 512, "is_animated": False,
+                                  "is_video": False} for i in range(count)]}
+        if method == "exportChatInviteLink":
+            return "https://t.me/+replay"
+        return True
+
+
+def _params(headers, body):
+    ctype = headers.get("Content-Type", "")
+    if ctype.startswith("multipart/"):
+        msg = email.message_from_bytes(b"Content-Type: " + ctype.encode() + b"\r\n\r\n" + body)
+        return {p.get_param("name", header="content-disposition"): p.get_payload(decode=True).decode("utf-8", "replace")
+                for p in msg.get_payload() if p.get_filename() is None}
+    if ctype.startswith("application/json"):
+        return json.loads(body or b"{}")
+    return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+
+def serve_stub(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *a):
+            pass
+
+        def _send(self, code, body, ctype="application/json"):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+            method = self.path.rsplit("/", 1)[-1]
+            try:
+                result = api.answer(method, _params(self.headers, body))
+            except StubError as e:
+                return self._send(400, json.dumps({"ok": False, "error_code": 400, "description": str(e)}).encode())
+            self._send(200, json.dumps({"ok": True, "result": result}).encode())
+
+        def do_GET(self):
+            if self.path.startswith("/file/"):
+                api.calls["file"] += 1
+                return self._send(200, api.image, "image/png")
+            self.do_POST()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-api", daemon=True).start()
+    return server
+
+
+# ------------- synthetic updates -------------
+WORDS = ("hello", "there", "what", "sticker", "group", "ok", "lol", "nice", "when", "meeting", "bot", "today",
+         "tomorrow", "thanks", "please", "link", "photo", "cool", "yes", "no")
+
+
+def synthetic(n, chats, users, seed=1):
+    rnd = random.Random(seed)
+    ids = itertools.count(1)
+    mids = defaultdict(lambda: itertools.count(1))
+    out = []
+
+    def message(chat, uid, **kw):
+        return {"message_id": next(mids[chat]), "date": int(time.time()), "chat": _chat(chat), "from": _user(uid), **kw}
+
+    def command(chat, uid, text, **kw):
+        cmd = text.split()[0]
+        return message(chat, uid, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(cmd)}], **kw)
+
+    for _ in range(n):
+        chat = -1000 - rnd.randrange(chats)
+        uid = rnd.randrange(2, users + 2)
+        r = rnd.random()
+        if r < 0.60:
+            text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 12)))
+            msg = message(chat, uid, text=text)
+        elif r < 0.65:
+            url = f"example{rnd.randrange(50)}.com/x"
+            msg = message(chat, uid, text=f"look {url}", entities=[{"type": "url", "offset": 5, "length": len(url)}])
+        elif r < 0.70:
+            msg = message(chat, uid, text="." + rnd.choice(("rules", "faq", "links", "..", "x")))
+        elif r < 0.80:
+            s = rnd.randrange(300)
+            msg = message(chat, uid, sticker={"file_id": f"s{s}", "file_unique_id": f"su{s}", "type": "regular",
+                                              "width": 512, "height": 512, "is_animated": False, "is_video": False,
+                                              "set_name": f"pack{s % 20}"})
+        elif r < 0.83:
+            joined = [_user(rnd.randrange(users + 2, users * 10)) for _ in range(rnd.randint(1, 3))]
+            msg = message(chat, joined[0]["id"], new_chat_members=joined)
+        elif r < 0.90:
+            msg = command(chat, uid, rnd.choice(("/rules", "/note rules", "/note rulez", "/listnotes", "/filters")))
+        elif r < 0.96:
+            quoted = message(chat, rnd.randrange(2, users + 2), text=" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 20))))
+            if rnd.random() < 0.5:
+                quoted["text"] = "quote of the day"  # repeats hit the sticker cache
+            msg = command(chat, uid, "/q", reply_to_message=quoted)
+        else:
+            p = rnd.randrange(40)
+            photo = [{"file_id": f"p{p}_{w}", "file_unique_id": f"pu{p}_{w}", "width": w, "height": w * 3 // 4,
+                      "file_size": 20000 * w // 320} for w in (90, 320, 800)]
+            msg = command(chat, uid, "/q", reply_to_message=message(chat, uid, photo=photo))
+        out.append({"update_id": next(ids), "message": msg})
+    return out
+
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(p / 100.0 * len(sorted_vals)))]
+
+
+# ------------- replay -------------
+async def seed(bot, chats):
+    for i in range(chats):
+        chat = -1000 - i
+        await bot.db_set_setting(chat, "rules", "Be nice.")
+        await bot.db_set_setting(chat, "welcome_on", "on" if i % 2 else "off")
+        await bot.db_set_setting(chat, "antilink", "on" if i % 3 == 0 else "off")
+        await bot.db_set_note(chat, "rules", "See /rules")
+        await bot.db_set_note(chat, "faq", "Read the pinned message.")
+        if i % 4 == 0:
+            await bot.db_add_filter(chat, "word", "spam")
+            await bot.db_add_filter(chat, "deny", "example7.com")
+    for s in range(0, 300, 15):
+        await bot.add_banned(f"su{s}")
+
+
+async def replay(bot, updates, concurrency, handler_times, update_times):
+    app = bot.application
+    queue = asyncio.Queue()
+    for u in updates:
+        queue.put_nowait(u)
+
+    async def worker():
+        while not queue.empty():
+            data = queue.get_nowait()
+            t0 = time.perf_counter()
+            await app.process_update(bot.Update.de_json(data, app.bot))
+            update_times.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await bot.members_wb.aflush()
+    return time.perf_counter() - t0
+
+
+def time_handlers(app, handler_times):
+    for handlers in app.handlers.values():
+        for h in handlers:
+            cb, name = h.callback, h.callback.__name__
+
+            async def timed(update, context, cb=cb, name=name):
+                t0 = time.perf_counter()
+                try:
+                    return await cb(update, context)
+                finally:
+                    handler_times[name].append(time.perf_counter() - t0)
+            h.callback = timed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--record", help="replay updates from a JSONL file instead of synthetic ones")
+    ap.add_argument("--real-limits", action="store_true", help="keep Telegram's per-chat send limits (slow)")
+    ap.add_argument("--verbose", action="store_true", help="keep the bot's INFO logging (one line per API call)")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--baseline", help="compare with results written earlier by --json")
+    args = ap.parse_args()
+    for name in ("record", "json", "baseline"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    api = StubAPI()
+    server = serve_stub(api)
+    os.environ.update(TELEGRAM_BOT_TOKEN=TOKEN, TELEGRAM_API_BASE=f"http://127.0.0.1:{server.server_port}",
+                      BOT_AUTOSTART="0")  # the replay drives the application on its own loop
+    if not args.real_limits:
+        os.environ.setdefault("API_RATE", "100000")
+        os.environ.setdefault("API_GROUP_PER_MINUTE", "1000000")
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    os.chdir(workdir)  # the bot keeps bot_data.db and stickers/ in the working directory
+
+    t0 = time.perf_counter()
+    import advanced_bot_full as bot  # noqa: E402
+    import_s = time.perf_counter() - t0
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.record:
+        with open(args.record) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = synthetic(args.updates, args.chats, args.users)
+
+    handler_times = defaultdict(list)
+    update_times = []
+    db_ops = Counter()
+    bot.db.timers.append(lambda op, el: db_ops.update((op,)))
+
+    async def run():
+        await bot.application.initialize()
+        await bot.application.start()
+        await seed(bot, args.chats)
+        db_ops.clear(); api.calls.clear()
+        time_handlers(bot.application, handler_times)
+        t_start = time.perf_counter()
+        elapsed = await replay(bot, updates, args.concurrency, handler_times, update_times)
+        # replies and block=False handlers run as tasks; the run ends when they are done
+        await bot.application.stop()
+        elapsed = time.perf_counter() - t_start
+        await bot.application.shutdown()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    bot.converter.close()
+    n = len(updates)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    lat = sorted(update_times)
+    result = {
+        "updates": n, "seconds": elapsed, "updates_per_sec": n / elapsed, "import_seconds": import_s,
+        "p50_ms": percentile(lat, 50) * 1000, "p99_ms": percentile(lat, 99) * 1000,
+        "db_ops_per_update": sum(db_ops.values()) / n, "api_calls_per_update": sum(api.calls.values()) / n,
+        "peak_rss_mb": rss, "peak_child_rss_mb": child_rss,
+        "handlers": {name: {"calls": len(v), "p50_ms": percentile(sorted(v), 50) * 1000,
+                            "p99_ms": percentile(sorted(v), 99) * 1000} for name, v in handler_times.items()},
+        "db_ops": dict(db_ops), "api_calls": dict(api.calls),
+    }
+
+    print(f"replayed {n} updates in {elapsed:.2f}s: {result['updates_per_sec']:.0f} updates/s "
+          f"(p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, import {import_s:.2f}s)")
+    print(f"per update: {result['db_ops_per_update']:.2f} DB calls, {result['api_calls_per_update']:.2f} Bot API calls")
+    print(f"peak RSS: {rss:.0f} MiB (conversion workers {child_rss:.0f} MiB)")
+    print(f"{'handler':<18}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, h in sorted(result["handlers"].items(), key=lambda kv: -kv[1]["calls"]):
+        print(f"{name:<18}{h['calls']:>8}{h['p50_ms']:>10.2f}{h['p99_ms']:>10.2f}")
+    print("top DB ops: " + ", ".join(f"{k}={v}" for k, v in db_ops.most_common(6)))
+    print("top API calls: " + ", ".join(f"{k}={v}" for k, v in api.calls.most_common(6)))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = json.load(f)
+        print("vs baseline:")
+        for key in ("updates_per_sec", "p50_ms", "p99_ms", "db_ops_per_update", "api_calls_per_update", "peak_rss_mb"):
+            old, new = base.get(key), result[key]
+            if old:
+                print(f"  {key:<22}{old:>10.2f} -> {new:>10.2f} ({(new - old) / old * 100:+.1f}%)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=1)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
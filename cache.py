@@ -0,0 +1,93 @@
+# cache.py
+# Small in-process caches shared by the bot's hot paths.
+
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Size-capped LRU mapping with hit/miss counters."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        val = self._data.get(key, _MISSING)
+        if val is _MISSING:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return val
+
+    def peek(self, key, default=None):
+        return self._data.get(key, default)
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def items(self):
+        """Snapshot of (key, value) pairs, least recently used first; does not touch recency."""
+        return list(self._data.items())
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0}
+
+
+class SizedLRU(LRUCache):
+    """LRUCache capped by the total len() of its values (e.g. bytes) instead of entry count."""
+
+    def __init__(self, maxbytes):
+        super().__init__(maxbytes)
+        self.bytes = 0
+
+    def put(self, key, value):
+        old = self._data.pop(key, _MISSING)
+        if old is not _MISSING:
+            self.bytes -= len(old)
+        if len(value) > self.maxsize:
+            return
+        self._data[key] = value
+        self.bytes += len(value)
+        while self.bytes > self.maxsize:
+            _, evicted = self._data.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        val = self._data.pop(key, _MISSING)
+        if val is _MISSING:
+            return default
+        self.bytes -= len(val)
+        return val
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {**super().stats(), "bytes": self.bytes}
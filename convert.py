@@ -0,0 +1,98 @@
+# convert.py
+# Bounded process pool for CPU-heavy sticker conversions, so Pillow decode /
+# resize / encode never runs on the bot's event loop.
+
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class ConversionBusy(Exception):
+    """Raised when more than max_pending jobs are already waiting."""
+
+
+class ConversionTimeout(Exception):
+    """Raised when a job does not finish within the service timeout."""
+
+
+class ConversionService:
+    def __init__(self, workers=2, max_pending=16, timeout=20.0):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool = None
+        self._sem = None
+        self.waiting = 0
+        self.running = 0
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "timeouts": 0, "rejected": 0}
+        self.timers = []  # fn(name, seconds, outcome) per job: wall time from pool submit to result
+
+    def _executor(self):
+        if self._pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            # forkserver/spawn children don't inherit the bot's threads and locks
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        return self._pool
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker process and return its (picklable) result."""
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.workers)
+        if self.waiting >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise ConversionBusy()
+        self.stats["submitted"] += 1
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            fut = self._executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            self.stats["failed"] += 1
+            raise
+        # the slot is held until the worker is actually free, even after a timeout
+        loop = asyncio.get_running_loop()
+        fut.add_done_callback(lambda f: loop.call_soon_threadsafe(self._release))
+        name = getattr(fn, "__name__", str(fn))
+        t0 = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self._timed(name, t0, "timeout")
+            log.warning("Conversion %s timed out after %ss", name, self.timeout)
+            raise ConversionTimeout()
+        except Exception:
+            self.stats["failed"] += 1
+            self._timed(name, t0, "error")
+            raise
+        self.stats["completed"] += 1
+        self._timed(name, t0, "ok")
+        return result
+
+    def _timed(self, name, t0, outcome):
+        if self.timers:
+            elapsed = time.perf_counter() - t0
+            for t in self.timers:
+                t(name, elapsed, outcome)
+
+    def _release(self):
+        self.running -= 1
+        self._sem.release()
+
+    def depth(self):
+        return self.waiting + self.running
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
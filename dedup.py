@@ -0,0 +1,54 @@
+# dedup.py
+# Bounded window of recent webhook update_ids. Telegram redelivers updates
+# it thinks we missed (slow responses, timeouts); a redelivery of something
+# in flight or already processed is acknowledged without running it again.
+
+import threading
+from collections import deque
+
+IN_FLIGHT, DONE = 1, 2
+
+
+class UpdateDedup:
+    def __init__(self, size=20000):
+        self.size = size
+        self._state = {}       # update_id -> [IN_FLIGHT | DONE, claim seq]
+        self._order = deque()  # (update_id, claim seq), oldest first
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.stats = {"claimed": 0, "duplicates": 0, "released": 0}
+
+    def claim(self, update_id):
+        """True if update_id is new (now in flight); False for a duplicate delivery."""
+        with self._lock:
+            if update_id in self._state:
+                self.stats["duplicates"] += 1
+                return False
+            self._seq += 1
+            self._state[update_id] = [IN_FLIGHT, self._seq]
+            self._order.append((update_id, self._seq))
+            while len(self._order) > self.size:
+                old, seq = self._order.popleft()
+                entry = self._state.get(old)
+                # released and re-claimed ids keep their newer entry
+                if entry is not None and entry[1] == seq:
+                    del self._state[old]
+            self.stats["claimed"] += 1
+            return True
+
+    def done(self, update_id):
+        with self._lock:
+            entry = self._state.get(update_id)
+            if entry is not None:
+                entry[0] = DONE
+
+    def release(self, update_id):
+        """Forget a claim that was not processed (e.g. rejected), so a redelivery runs."""
+        with self._lock:
+            # the stale (id, seq) pair left in _order is skipped on eviction
+            if self._state.pop(update_id, None) is not None:
+                self.stats["released"] += 1
+
+    def in_flight(self):
+        with self._lock:
+            return sum(1 for s, _ in self._state.values() if s == IN_FLIGHT)
@@ -0,0 +1,112 @@
+# flood.py
+# O(1) flood detection: a fixed-size ring of the last `limit` message
+# timestamps per (chat, user), with idle entries swept in the background.
+#
+# Each ring is a single array('d') of limit+1 slots: the timestamps followed
+# by the write index, so a tracked user costs one small object.
+
+import sys
+import asyncio
+from array import array
+
+_NEVER = float("-inf")
+
+
+_TEMPLATES = {}
+
+
+def _ring(limit):
+    # copying a prebuilt ring is ~3x cheaper than building one from a list
+    tpl = _TEMPLATES.get(limit)
+    if tpl is None:
+        tpl = _TEMPLATES[limit] = array("d", [_NEVER] * limit + [0.0])
+    return tpl[:]
+
+
+def _last(r):
+    # most recent write sits just before the write index (wrapping: index 0 -> slot limit-1)
+    return r[(int(r[-1]) - 1) % (len(r) - 1)]
+
+
+class FloodControl:
+    def __init__(self, limit=6, window=6.0):
+        self.limit = limit
+        self.window = window
+        self._chats = {}  # chat_id -> {user_id: ring}
+        self._windows = {}  # chat_id -> window, only for chats not on the default
+        self.evicted = 0
+
+    def hit(self, chat_id, user_id, now, limit=None, window=None):
+        """Record a message; True when it is the `limit`-th within `window` seconds."""
+        limit = limit or self.limit
+        window = window or self.window
+        if window != self.window:
+            self._windows[chat_id] = window
+        users = self._chats.get(chat_id)
+        if users is None:
+            users = self._chats[chat_id] = {}
+        r = users.get(user_id)
+        if r is None or len(r) != limit + 1:
+            r = users[user_id] = _ring(limit)
+        idx = int(r[-1])
+        r[idx] = now
+        idx = idx + 1 if idx + 1 < limit else 0
+        r[-1] = idx
+        # after the write, idx points at the oldest of the last `limit` messages
+        return r[idx] > now - window
+
+    def reset(self, chat_id, user_id):
+        users = self._chats.get(chat_id)
+        if users is not None:
+            users.pop(user_id, None)
+
+    def sweep(self, now, idle=None):
+        """Drop users (and then chats) idle for `idle` seconds or the chat's own longer window."""
+        idle = idle or self.window
+        dropped = 0
+        for chat_id in list(self._chats):
+            dropped += self._sweep_chat(chat_id, now, idle)
+        return dropped
+
+    def _sweep_chat(self, chat_id, now, idle):
+        users = self._chats.get(chat_id)
+        if users is None:
+            return 0
+        # a ring is only dead once its last message has left the chat's window
+        cutoff = now - max(idle, self._windows.get(chat_id, 0))
+        stale = [uid for uid, r in users.items() if _last(r) <= cutoff]
+        for uid in stale:
+            del users[uid]
+        if not users:
+            del self._chats[chat_id]
+            self._windows.pop(chat_id, None)
+        self.evicted += len(stale)
+        return len(stale)
+
+    async def run_sweeper(self, clock, interval=30.0, idle=None, batch=2000):
+        """Periodically evict idle entries, yielding to the loop between chunks."""
+        while True:
+            await asyncio.sleep(interval)
+            now, seen = clock(), 0
+            for chat_id in list(self._chats):
+                users = self._chats.get(chat_id)
+                seen += len(users) if users else 0
+                self._sweep_chat(chat_id, now, idle or self.window)
+                if seen >= batch:
+                    seen = 0
+                    await asyncio.sleep(0)
+
+    def tracked(self):
+        return sum(len(u) for u in self._chats.values())
+
+    def memory_footprint(self):
+        """Approximate bytes held by the tracker (dicts, rings and their arrays)."""
+        total = sys.getsizeof(self._chats) + sys.getsizeof(self._windows)
+        for users in self._chats.values():
+            total += sys.getsizeof(users)
+            total += sum(map(sys.getsizeof, users.values()))
+        return total
+
+    def stats(self):
+        return {"chats": len(self._chats), "users": self.tracked(), "evicted": self.evicted,
+                "bytes": self.memory_footprint()}
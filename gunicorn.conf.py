@@ -0,0 +1,31 @@
+# gunicorn.conf.py
+# WEB_CONCURRENCY workers, each owning a shard of chats (see shard.py).
+# Shard slots are handed out in the master so a restarted worker takes over
+# the slot (and internal port) of the one it replaces.
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+
+def pre_fork(server, worker):
+    # only slots < num_workers exist (SHARD_COUNT). A dead worker has already left
+    # server.WORKERS, so its slot is free for the replacement; during a HUP reload
+    # the old generation still holds every slot, and each new worker shares the
+    # slot of the oldest holder, which gunicorn stops once the new one is up
+    holders = {i: [] for i in range(server.num_workers)}
+    for w in server.WORKERS.values():
+        if getattr(w, "shard_index", None) in holders:
+            holders[w.shard_index].append(w.age)
+    worker.shard_index = min(holders, key=lambda i: (len(holders[i]), min(holders[i], default=0), i))
+
+
+def post_fork(server, worker):
+    os.environ["SHARD_INDEX"] = str(worker.shard_index)
+    os.environ["SHARD_COUNT"] = str(server.num_workers)
+
+
+def child_exit(server, worker):
+    server.log.info("Shard slot %s released by worker %s", getattr(worker, "shard_index", None), worker.pid)
@@ -0,0 +1,199 @@
+# imaging.py
+# Sticker image work (Pillow): photo -> 512px WEBP and text -> WEBP.
+# Kept free of bot state so it can run inside conversion worker processes.
+
+import io
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+# bump sticker_cache.RENDER_VERSION whenever output for the same input changes
+
+
+# refuse images that would decode to more than this many pixels
+MAX_PIXELS = 40_000_000
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+
+# -- WEBP encoding policy --
+STICKER_MAX_BYTES = 512 * 1024  # Telegram's limit for static sticker files
+
+# lossless_effort/lossless_method tune the lossless encoder, quality/method
+# the lossy one; steps bounds the quality search when output is over budget.
+# Keep the names in step with sticker_cache.PROFILE_NAMES.
+PROFILES = {
+    "speed":    {"lossless_effort": 25, "lossless_method": 1, "quality": 80, "min_quality": 40, "method": 2, "steps": 2},
+    "balanced": {"lossless_effort": 60, "lossless_method": 4, "quality": 85, "min_quality": 35, "method": 4, "steps": 3},
+    "size":     {"lossless_effort": 90, "lossless_method": 6, "quality": 80, "min_quality": 30, "method": 6, "steps": 4},
+}
+
+
+def _save(img, **kw):
+    out = io.BytesIO()
+    img.save(out, "WEBP", **kw)
+    return out.getvalue()
+
+
+def is_flat(img, max_colors=256):
+    """Few distinct colours (text, screenshots, drawings): lossless wins."""
+    return img.resize((64, 64), Image.NEAREST).getcolors(max_colors) is not None
+
+
+def encode_webp(img, lossless=None, profile="balanced", budget=STICKER_MAX_BYTES):
+    """Encode img as WEBP within budget bytes; returns (data, info)."""
+    p = PROFILES.get(profile) or PROFILES["balanced"]
+    t0 = time.perf_counter()
+    if lossless is None:
+        lossless = is_flat(img)
+    tries = 0
+    if lossless:
+        data = _save(img, lossless=True, quality=p["lossless_effort"], method=p["lossless_method"]); tries += 1
+        if len(data) <= budget:
+            return data, _info("lossless", None, data, tries, t0, profile)
+    # lossy: profile quality first, then a bounded search for the best that fits
+    q = p["quality"]
+    data = _save(img, quality=q, method=p["method"]); tries += 1
+    if len(data) > budget:
+        lo, hi, best = p["min_quality"], q - 1, None
+        for _ in range(p["steps"]):
+            if lo > hi: break
+            mid = (lo + hi) // 2
+            cand = _save(img, quality=mid, method=p["method"]); tries += 1
+            if len(cand) <= budget:
+                best, q, lo = cand, mid, mid + 1
+            else:
+                hi = mid - 1
+        if best is None:
+            q = p["min_quality"]
+            best = _save(img, quality=q, method=p["method"]); tries += 1
+        data = best
+    return data, _info("lossy", q, data, tries, t0, profile)
+
+
+def _info(mode, quality, data, tries, t0, profile):
+    return {"mode": mode, "quality": quality, "bytes": len(data), "tries": tries,
+            "encode_ms": (time.perf_counter() - t0) * 1000, "profile": profile}
+
+
+def prepare_image(raw):
+    """Decode raw image bytes into an RGBA image sized for a sticker."""
+    img = Image.open(io.BytesIO(raw))
+    max_dim = 512
+    w, h = img.size
+    if w * h > MAX_PIXELS:
+        raise Image.DecompressionBombError(f"{w}x{h} exceeds {MAX_PIXELS} pixels")
+    scale = min(max_dim / w, max_dim / h, 1)
+    new_w = max(int(w * scale), 1); new_h = max(int(h * scale), 1)
+    # JPEG: let the decoder downscale by 1/2..1/8 while staying >= the target
+    if img.format == "JPEG" and scale < 1:
+        img.draft("RGB", (new_w, new_h))
+    img = img.convert("RGBA")
+    img = img.resize((new_w, new_h), Image.LANCZOS, reducing_gap=3.0)
+    if max(new_w, new_h) == max_dim:
+        return img  # already a valid sticker size; no transparent padding to encode
+    canvas = Image.new("RGBA", (max_dim, max_dim), (0,0,0,0))
+    canvas.paste(img, ((max_dim-new_w)//2, (max_dim-new_h)//2), img)
+    return canvas
+
+
+# -- text rendering: fonts loaded once per size, glyph advances cached --
+FONT_PATHS = ("/system/fonts/DroidSans.ttf", "/system/fonts/Roboto-Regular.ttf", "DejaVuSans.ttf")
+TEXT_MAX_SIZE = 36
+TEXT_MIN_SIZE = 10
+TEXT_MARGIN = 20
+LINE_GAP = 6
+
+_font_path = False  # unresolved; None once we know no truetype font exists
+_fonts = {}         # size -> (font, {char: advance}, line height)
+
+
+def _font(size):
+    global _font_path
+    entry = _fonts.get(size)
+    if entry is not None:
+        return entry
+    if _font_path is False:
+        _font_path = None
+        for fpath in FONT_PATHS:
+            try:
+                ImageFont.truetype(fpath, size); _font_path = fpath; break
+            except Exception:
+                pass
+    font = ImageFont.truetype(_font_path, size) if _font_path else ImageFont.load_default()
+    if hasattr(font, "getmetrics"):
+        ascent, descent = font.getmetrics()
+        line_h = ascent + descent
+    else:
+        # the bitmap fallback (Pillow < 10) has no metrics; measure a tall/deep pair
+        left, top, right, bottom = font.getbbox("Ay")
+        line_h = bottom - min(top, 0)
+    entry = _fonts[size] = (font, {}, line_h)
+    return entry
+
+
+def _width(text, font, advances):
+    w = 0.0
+    for ch in text:
+        adv = advances.get(ch)
+        if adv is None:
+            adv = advances[ch] = font.getlength(ch)
+        w += adv
+    return w
+
+
+def layout_text(text, size, max_w):
+    """Greedy word wrap from cached advances: ([(line, width)], block height)."""
+    font, adv, line_h = _font(size)
+    space = _width(" ", font, adv)
+    lines = []; cur = []; cur_w = 0.0
+    for word in text.split():
+        ww = _width(word, font, adv)
+        if cur and cur_w + space + ww > max_w:
+            lines.append((" ".join(cur), cur_w)); cur = [word]; cur_w = ww
+        else:
+            cur_w = cur_w + space + ww if cur else ww
+            cur.append(word)
+    if cur: lines.append((" ".join(cur), cur_w))
+    height = len(lines) * line_h + max(len(lines) - 1, 0) * LINE_GAP
+    return lines, height
+
+
+def fit_text(text, max_dim=512):
+    """Largest font size (binary search) whose wrapped block fits the canvas."""
+    box = max_dim - 2 * TEXT_MARGIN
+    _font(TEXT_MAX_SIZE)  # resolves _font_path
+    if not _font_path:
+        # only the bitmap fallback font is available; it has a single size
+        return TEXT_MAX_SIZE, layout_text(text, TEXT_MAX_SIZE, box)
+    lo, hi = TEXT_MIN_SIZE, TEXT_MAX_SIZE
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        lines, height = layout_text(text, mid, box)
+        if height <= box and all(w <= box for _, w in lines):
+            best = (mid, (lines, height)); lo = mid + 1
+        else:
+            hi = mid - 1
+    return best or (TEXT_MIN_SIZE, layout_text(text, TEXT_MIN_SIZE, box))
+
+
+def render_text_image(text):
+    max_dim = 512
+    canvas = Image.new("RGBA", (max_dim, max_dim), (0,0,0,0))
+    draw = ImageDraw.Draw(canvas)
+    size, (lines, total_h) = fit_text(text, max_dim)
+    font, _, line_h = _font(size)
+    y = (max_dim - total_h)//2
+    for ln, w_text in lines:
+        x = int((max_dim - w_text)//2)
+        draw.text((x, y), ln, font=font, fill=(255,255,255,255))
+        y += line_h + LINE_GAP
+    return canvas
+
+
+# picklable entry points for the conversion pool: return (bytes, encode info)
+def convert_image(raw, profile="balanced"):
+    return encode_webp(prepare_image(raw), profile=profile)
+
+def render_text(text, profile="balanced"):
+    return encode_webp(render_text_image(text), lossless=True, profile=profile)
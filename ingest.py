@@ -0,0 +1,160 @@
+# ingest.py
+# Webhook ingestion: updates received by the (sync) Flask view are handed to a
+# bounded queue on one long-lived asyncio loop running in a background thread,
+# where a pool of consumers feeds them to application.process_update.
+
+import asyncio
+import logging
+import threading
+from contextlib import nullcontext
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the queue stayed full for put_timeout seconds."""
+
+
+class UpdateIngestor:
+    def __init__(self, application, queue_size=1000, workers=8, ordered=False, put_timeout=10.0):
+        self.application = application
+        self.queue_size = queue_size
+        self.workers = max(1, workers)
+        # ordered: one queue + consumer per shard, chats hashed onto shards so
+        # each chat's updates are processed strictly in arrival order
+        self.ordered = ordered
+        self.put_timeout = put_timeout
+        self.loop = None
+        self._queues = []
+        self._consumers = []
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._init_lock = None
+        self.on_start = []  # coroutine functions run as background tasks on the loop
+        self.trace = None   # fn(update) -> context manager wrapped around process_update
+        self.on_processed = []  # fn(update) after process_update returns or raises
+        self._background = []
+        self._initialized = False
+        self.stats = {"received": 0, "processed": 0, "errors": 0, "rejected": 0}
+
+    # -- lifecycle --
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="bot-loop", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._startup())
+        except Exception:
+            log.exception("Bot loop failed to start.")
+        finally:
+            self._ready.set()
+        self.loop.run_forever()
+
+    async def _startup(self):
+        if self.ordered:
+            size = max(1, self.queue_size // self.workers)
+            self._queues = [asyncio.Queue(size) for _ in range(self.workers)]
+            self._consumers = [asyncio.create_task(self._consume(q)) for q in self._queues]
+        else:
+            q = asyncio.Queue(self.queue_size)
+            self._queues = [q]
+            self._consumers = [asyncio.create_task(self._consume(q)) for _ in range(self.workers)]
+        self._init_lock = asyncio.Lock()
+        # initialize in the background so start() returns as soon as the loop runs
+        self._background = [asyncio.create_task(self._warm_up())]
+        self._background += [asyncio.create_task(fn()) for fn in self.on_start]
+
+    async def _warm_up(self, delay=1.0):
+        while True:
+            try:
+                await self.initialize()
+                return
+            except Exception as e:
+                log.warning("Bot initialization failed (%s); retrying in %.0fs", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+
+    async def initialize(self):
+        """Initialize the application once; also retried by consumers (e.g. Telegram unreachable at boot)."""
+        if self._initialized:
+            return
+        async with self._init_lock:
+            if not self._initialized:
+                await self.application.initialize()
+                # running, so create_task()/block=False work is tracked and awaited on stop
+                await self.application.start()
+                self._initialized = True
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the bot loop from another thread and wait for it."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self, timeout=10.0):
+        if self._thread is None or self.loop is None:
+            return
+        try:
+            self.run(self._shutdown(), timeout)
+        except Exception:
+            log.exception("Bot loop did not shut down cleanly.")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+    async def _shutdown(self):
+        for q in self._queues:
+            await q.join()
+        for c in self._consumers + self._background:
+            c.cancel()
+        if self._initialized:
+            await self.application.stop()
+            await self.application.shutdown()
+
+    # -- ingestion --
+    def _queue_for(self, update):
+        if len(self._queues) == 1:
+            return self._queues[0]
+        chat = update.effective_chat
+        key = chat.id if chat else (update.effective_user.id if update.effective_user else update.update_id)
+        return self._queues[hash(key) % len(self._queues)]
+
+    def submit(self, update):
+        """Enqueue an update; blocks while the queue is full (backpressure)."""
+        self.start()
+        self.stats["received"] += 1
+        fut = asyncio.run_coroutine_threadsafe(self._put(update), self.loop)
+        try:
+            fut.result(self.put_timeout)
+        except Exception:
+            fut.cancel()
+            self.stats["rejected"] += 1
+            raise QueueFull()
+
+    async def _put(self, update):
+        await self._queue_for(update).put(update)
+
+    async def _consume(self, q):
+        while True:
+            update = await q.get()
+            try:
+                await self.initialize()
+                with self.trace(update) if self.trace else nullcontext():
+                    await self.application.process_update(update)
+                self.stats["processed"] += 1
+            except Exception:
+                self.stats["errors"] += 1
+                log.exception("Error processing update %s", getattr(update, "update_id", None))
+            finally:
+                for fn in self.on_processed:
+                    fn(update)
+                q.task_done()
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
@@ -0,0 +1,132 @@
+# linkfilter.py
+# Per-chat antilink / blocklist rules, compiled once and cached.
+#
+# Links come from the message entities Telegram has already parsed (url and
+# text_link), so plain text never goes through a link regex. Domains are
+# matched by walking the host's suffixes against allow/deny sets. Blocked
+# single words are a set probed with the message's tokens; phrases are
+# compiled into one trie-shaped regex per chat, so matching cost does not grow
+# with the alternation count. Rules are rebuilt only when an admin edits the
+# lists (see FilterEngine.invalidate).
+
+import re
+from urllib.parse import urlsplit
+
+from cache import LRUCache
+
+KINDS = ("allow", "deny", "word")
+URL_ENTITIES = ("url", "text_link")
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def host_of(url):
+    if "://" not in url:
+        url = "http://" + url
+    try:
+        host = urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def _suffixes(host):
+    # a.b.example.com -> a.b.example.com, b.example.com, example.com, com
+    while host:
+        yield host
+        _, _, host = host.partition(".")
+
+
+def normalize(kind, value):
+    value = value.strip().lower()
+    return host_of(value) if kind in ("allow", "deny") else value
+
+
+def trie_pattern(words):
+    """Regex body matching any of `words`, factored by shared prefixes."""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def emit(node):
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+def message_urls(msg):
+    """URLs Telegram found in the message text or caption."""
+    out = []
+    for parse in (msg.parse_entities, msg.parse_caption_entities):
+        for ent, text in parse(URL_ENTITIES).items():
+            out.append(ent.url if ent.type == "text_link" else text)
+    return out
+
+
+class Rules:
+    __slots__ = ("allow", "deny", "words", "tokens", "phrase_re")
+
+    def __init__(self, allow=(), deny=(), words=()):
+        self.allow = frozenset(allow)
+        self.deny = frozenset(deny)
+        self.words = tuple(sorted(set(words)))
+        self.tokens = frozenset(w for w in self.words if _TOKEN_RE.fullmatch(w))
+        phrases = [w for w in self.words if w not in self.tokens]
+        self.phrase_re = re.compile(rf"(?<!\w)(?:{trie_pattern(phrases)})(?!\w)", re.I) if phrases else None
+
+    def __bool__(self):
+        return bool(self.allow or self.deny or self.words)
+
+    def _listed(self, host, domains):
+        return any(s in domains for s in _suffixes(host))
+
+    def check(self, text, urls, antilink):
+        """Reason the message breaks the rules ("link" | "domain" | "word"), or None."""
+        for url in urls:
+            host = host_of(url)
+            if self.deny and self._listed(host, self.deny):
+                return "domain"
+            if antilink and not (self.allow and self._listed(host, self.allow)):
+                return "link"
+        if not text:
+            return None
+        if self.tokens and not self.tokens.isdisjoint(_TOKEN_RE.findall(text.lower())):
+            return "word"
+        if self.phrase_re is not None and self.phrase_re.search(text):
+            return "word"
+        return None
+
+
+EMPTY = Rules()
+
+
+class FilterEngine:
+    def __init__(self, max_chats=10000):
+        self._rules = LRUCache(max_chats)
+        self.builds = 0
+
+    def get(self, chat_id):
+        return self._rules.get(chat_id)
+
+    def load(self, chat_id, rows):
+        """Compile (kind, value) rows for a chat and cache the result."""
+        lists = {k: [] for k in KINDS}
+        for kind, value in rows:
+            if kind in lists:
+                lists[kind].append(value)
+        rules = Rules(lists["allow"], lists["deny"], lists["word"]) if rows else EMPTY
+        self.builds += 1
+        self._rules.put(chat_id, rules)
+        return rules
+
+    def invalidate(self, chat_id):
+        self._rules.pop(chat_id)
+
+    def stats(self):
+        return {"builds": self.builds, "cache": self._rules.stats()}
@@ -0,0 +1,60 @@
+# media.py
+# Media ingestion for /q and /kang: choose the cheapest source that still
+# yields a full-size sticker, refuse oversized or non-image files before (or
+# right after) downloading, and hand the bytes on without extra copies.
+
+import io
+
+import imghdr
+
+IMAGE_KINDS = frozenset(("jpeg", "png", "gif", "webp", "bmp", "tiff"))
+
+
+class MediaRejected(Exception):
+    """The source is too large or not an image we can convert."""
+
+
+def pick_photo(sizes, target=512):
+    """Smallest PhotoSize whose longer side reaches target, else the largest."""
+    if not sizes:
+        return None
+    best = None
+    for ps in sizes:
+        if max(ps.width, ps.height) >= target and (best is None or ps.width * ps.height < best.width * best.height):
+            best = ps
+    return best or max(sizes, key=lambda ps: ps.width * ps.height)
+
+
+def check_size(src, max_bytes):
+    size = getattr(src, "file_size", None)
+    if size and size > max_bytes:
+        raise MediaRejected(f"file is {size} bytes, limit {max_bytes}")
+
+
+async def download(bot_file, max_bytes=None):
+    if max_bytes and bot_file.file_size and bot_file.file_size > max_bytes:
+        raise MediaRejected(f"file is {bot_file.file_size} bytes, limit {max_bytes}")
+    bio = io.BytesIO()
+    try:
+        await bot_file.download_to_memory(out=bio)
+    except AttributeError:
+        await bot_file.download(out=bio)
+    # getvalue() shrinks and hands over BytesIO's own buffer; read() copied it
+    return bio.getvalue()
+
+
+def sniff(data):
+    """Image type from the header (bundled imghdr), or None."""
+    with memoryview(data) as mv:
+        return imghdr.what(None, h=bytes(mv[:32]))
+
+
+async def fetch_image(src, max_bytes):
+    """Download src (PhotoSize/Document) as image bytes, enforcing the limits."""
+    check_size(src, max_bytes)
+    data = await download(await src.get_file(), max_bytes)
+    if len(data) > max_bytes:
+        raise MediaRejected(f"downloaded {len(data)} bytes, limit {max_bytes}")
+    if sniff(data) not in IMAGE_KINDS:
+        raise MediaRejected("not a supported image")
+    return data
@@ -0,0 +1,152 @@
+# metrics.py
+# Minimal Prometheus-text metrics: fixed-bucket histograms and counters that
+# are cheap enough to leave on (one bisect and a few increments under a lock
+# per observation), plus gauges read from callbacks at scrape time.
+
+import time
+import bisect
+import functools
+import threading
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names, values, extra=""):
+    parts = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help = name, help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(k, list(v)) for k, v in self._series.items()]
+        for labels, s in sorted(series):
+            acc = 0
+            for le, n in zip(self.buckets + ("+Inf",), s):
+                acc += n
+                le = 'le="%s"' % le
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {s[-1]!r}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {acc}")
+        return out
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help = name, help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        out += [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in values]
+        return out
+
+
+class Collected:
+    """Metric read at scrape time: fn() returns a number or {label value(s): number}."""
+
+    def __init__(self, name, help, fn, kind="gauge", labelnames=()):
+        self.name, self.help, self.fn, self.kind = name, help, fn, kind
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        value = self.fn()
+        if isinstance(value, dict):
+            for k, v in sorted(value.items(), key=lambda kv: str(kv[0])):
+                k = k if isinstance(k, tuple) else (k,)
+                out.append(f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}")
+        else:
+            out.append(f"{self.name} {_fmt_value(value)}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, fn, labelnames=()):
+        return self._add(Collected(name, help, fn, "gauge", labelnames))
+
+    def counter_fn(self, name, help, fn, labelnames=()):
+        return self._add(Collected(name, help, fn, "counter", labelnames))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            try:
+                lines += m.render()
+            except Exception:
+                continue  # one broken collector must not take the endpoint down
+        return "\n".join(lines) + "\n"
+
+
+def instrument_handlers(application, histogram, errors=None):
+    """Wrap every registered handler callback so its latency lands in histogram."""
+    for group, handlers in application.handlers.items():
+        for h in handlers:
+            cb = h.callback
+            if getattr(cb, "_metered", False):
+                continue
+            h.callback = _metered(cb, histogram, errors, getattr(cb, "__name__", type(h).__name__))
+
+
+def _metered(cb, histogram, errors, name):
+    @functools.wraps(cb)
+    async def wrapper(update, context):
+        t0 = time.perf_counter()
+        try:
+            return await cb(update, context)
+        except Exception:
+            if errors is not None:
+                errors.inc(name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - t0, name)
+    wrapper._metered = True
+    return wrapper
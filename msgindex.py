@@ -0,0 +1,43 @@
+# msgindex.py
+# Per-chat ring buffer of message IDs the bot has actually seen, so /purge can
+# delete real messages instead of walking every integer in a range.
+
+from collections import deque
+
+from cache import LRUCache
+
+
+class MessageIndex:
+    def __init__(self, per_chat=3000, max_chats=20000):
+        self.per_chat = per_chat
+        self._chats = LRUCache(max_chats)  # chat_id -> deque of ids, ascending
+
+    def add(self, chat_id, message_id):
+        ids = self._chats.peek(chat_id)
+        if ids is None:
+            ids = deque(maxlen=self.per_chat)
+            self._chats.put(chat_id, ids)
+        if not ids or message_id > ids[-1]:
+            ids.append(message_id)
+        elif message_id not in ids:
+            # late arrival (concurrent processing); keep the ring sorted
+            ordered = sorted((*ids, message_id))[-self.per_chat:]
+            ids.clear(); ids.extend(ordered)
+
+    def between(self, chat_id, start, end):
+        """Known ids in [start, end], ascending."""
+        ids = self._chats.peek(chat_id)
+        return [m for m in ids if start <= m <= end] if ids else []
+
+    def covered_from(self, chat_id):
+        """Oldest id still indexed for the chat (older ids are unknown), or None."""
+        ids = self._chats.peek(chat_id)
+        return ids[0] if ids else None
+
+    def discard(self, chat_id, message_ids):
+        ids = self._chats.peek(chat_id)
+        if not ids:
+            return
+        drop = set(message_ids)
+        keep = [m for m in ids if m not in drop]
+        ids.clear(); ids.extend(keep)
@@ -0,0 +1,88 @@
+# note_index.py
+# In-memory index of note keys per chat, so ".key" lookups that miss (".."
+# or "...", typos) resolve without touching SQLite, plus a bounded LRU of
+# note values and prefix / fuzzy suggestions over the sorted key list.
+
+import difflib
+from bisect import bisect_left, insort
+
+from cache import LRUCache
+
+_ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789_-"
+FUZZY_WINDOW = 400
+# one-edit expansion is ~40 * len(key) strings; longer keys skip straight to fuzzy
+EDIT_MAX_LEN = 64
+
+
+def _edits1(word):
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    out = {a + b[1:] for a, b in splits if b}
+    out.update(a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1)
+    out.update(a + c + b[1:] for a, b in splits if b for c in _ALPHABET)
+    out.update(a + c + b for a, b in splits for c in _ALPHABET)
+    out.discard(word)
+    return out
+
+
+class NoteIndex:
+    def __init__(self, max_chats=5000, max_values=2000):
+        self._keys = LRUCache(max_chats)    # chat_id -> (set, sorted list) of keys
+        self.values = LRUCache(max_values)  # (chat_id, key) -> value
+        self.negative = 0                   # misses answered from the key set
+
+    def load(self, chat_id, keys):
+        ordered = sorted(set(keys))
+        self._keys.put(chat_id, (set(ordered), ordered))
+
+    def keys(self, chat_id):
+        entry = self._keys.get(chat_id)
+        return None if entry is None else entry[1]
+
+    def has(self, chat_id, key):
+        """True/False if the chat's keys are indexed, None when it must be loaded."""
+        entry = self._keys.get(chat_id)
+        if entry is None:
+            return None
+        if key in entry[0]:
+            return True
+        self.negative += 1
+        return False
+
+    def set(self, chat_id, key, value):
+        entry = self._keys.peek(chat_id)
+        if entry is not None and key not in entry[0]:
+            entry[0].add(key); insort(entry[1], key)
+        self.values.put((chat_id, key), value)
+
+    def delete(self, chat_id, key):
+        entry = self._keys.peek(chat_id)
+        if entry is not None and key in entry[0]:
+            entry[0].discard(key)
+            del entry[1][bisect_left(entry[1], key)]
+        self.values.pop((chat_id, key))
+
+    def suggest(self, chat_id, key, n=3):
+        """Keys starting with `key`, else the closest spellings."""
+        entry = self._keys.peek(chat_id)
+        if entry is None or not entry[1] or not key:
+            return []
+        ordered = entry[1]
+        i = bisect_left(ordered, key)
+        out = []
+        while i < len(ordered) and len(out) < n and ordered[i].startswith(key):
+            out.append(ordered[i]); i += 1
+        if out:
+            return out
+        # single typos: probe the key set with every one-edit variant
+        keyset = entry[0]
+        if len(key) <= min(EDIT_MAX_LEN, max(map(len, entry[1])) + 1):
+            out = sorted(k for k in _edits1(key) if k in keyset)[:n]
+            if out:
+                return out
+        # otherwise fuzzy-match a bounded window of neighbouring keys
+        lo = max(0, i - FUZZY_WINDOW // 2)
+        near = [k for k in ordered[lo:lo + FUZZY_WINDOW] if abs(len(k) - len(key)) <= 2]
+        return difflib.get_close_matches(key, near, n=n, cutoff=0.7)
+
+    def stats(self):
+        return {"chats": len(self._keys), "negative_hits": self.negative, "values": self.values.stats()}
@@ -0,0 +1,143 @@
+# notices.py
+# Raid-mode notice coalescing. While a chat sees a burst of joins or
+# messages, welcomes are merged into one message per window and moderation
+# notices are folded into a single summary message that is edited in place,
+# so the bot does not spend its own rate limit answering a raid.
+
+import time
+import asyncio
+import logging
+from collections import deque
+
+from cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+NOTICE_TEXT = {
+    "link": "link messages removed",
+    "flood": "users muted for flooding",
+    "domain": "messages linking blocked sites removed",
+    "word": "messages with blocked words removed",
+}
+
+
+class _ChatState:
+    __slots__ = ("joins", "msgs", "raid_until", "welcome_names", "welcome_tpl",
+                 "welcome_task", "counts", "summary", "summary_task")
+
+    def __init__(self):
+        self.joins = deque()
+        self.msgs = deque()
+        self.raid_until = 0.0
+        self.welcome_names = []
+        self.welcome_tpl = None
+        self.welcome_task = None
+        self.counts = {}
+        self.summary = None       # sent summary Message, edited as counts grow
+        self.summary_task = None
+
+
+class NoticeAggregator:
+    def __init__(self, window=3.0, join_burst=5, join_window=10.0, msg_burst=30, msg_window=5.0,
+                 cooldown=60.0, max_names=50, max_chats=10000):
+        self.window = window
+        self.join_burst, self.join_window = join_burst, join_window
+        self.msg_burst, self.msg_window = msg_burst, msg_window
+        self.cooldown = cooldown
+        self.max_names = max_names
+        self._chats = LRUCache(max_chats)
+        self.stats = {"raids": 0, "welcomes_merged": 0, "notices_folded": 0}
+
+    def _state(self, chat_id):
+        st = self._chats.peek(chat_id)
+        if st is None:
+            st = _ChatState()
+            self._chats.put(chat_id, st)
+        return st
+
+    # -- burst detection --
+    # bursts are measured on the time messages were sent (msg.date), not when we
+    # get to process them: a throttled backlog must not smear a raid out
+    def _bump(self, st, events, n, burst, window, sent):
+        for _ in range(n):
+            events.append(sent)
+        while events and events[0] <= sent - window:
+            events.popleft()
+        while len(events) > burst:
+            events.popleft()
+        if len(events) >= burst:
+            now = time.time()
+            if st.raid_until <= now:
+                self.stats["raids"] += 1
+            # the cooldown runs from detection, even when the burst is old
+            st.raid_until = max(sent, now) + self.cooldown
+
+    def note_join(self, chat_id, n=1, sent=None):
+        st = self._state(chat_id)
+        self._bump(st, st.joins, n, self.join_burst, self.join_window, sent or time.time())
+
+    def note_message(self, chat_id, sent=None):
+        st = self._state(chat_id)
+        self._bump(st, st.msgs, 1, self.msg_burst, self.msg_window, sent or time.time())
+
+    def raid(self, chat_id, now=None):
+        st = self._chats.peek(chat_id)
+        if st is None:
+            return False
+        if st.raid_until > (now or time.time()):
+            return True
+        st.summary = None; st.counts = {}
+        return False
+
+    # -- welcomes --
+    def queue_welcome(self, bot, chat_id, names, template):
+        st = self._state(chat_id)
+        st.welcome_names.extend(names)
+        st.welcome_tpl = template
+        self.stats["welcomes_merged"] += len(names)
+        if st.welcome_task is None or st.welcome_task.done():
+            st.welcome_task = asyncio.create_task(self._flush_welcome(bot, chat_id, st))
+
+    async def _flush_welcome(self, bot, chat_id, st):
+        await asyncio.sleep(self.window)
+        names, st.welcome_names = st.welcome_names, []
+        if not names:
+            return
+        shown = ", ".join(names[:self.max_names])
+        if len(names) > self.max_names:
+            shown += f" and {len(names) - self.max_names} more"
+        try:
+            await bot.send_message(chat_id, (st.welcome_tpl or "Welcome {name}!").replace("{name}", shown))
+        except Exception:
+            log.debug("merged welcome failed in %s", chat_id, exc_info=True)
+
+    # -- moderation notices --
+    def fold_notice(self, bot, chat_id, kind):
+        st = self._state(chat_id)
+        st.counts[kind] = st.counts.get(kind, 0) + 1
+        self.stats["notices_folded"] += 1
+        if st.summary_task is None or st.summary_task.done():
+            st.summary_task = asyncio.create_task(self._flush_summary(bot, chat_id, st))
+
+    def _summary_text(self, st):
+        parts = [f"{n} {NOTICE_TEXT.get(k, k)}" for k, n in st.counts.items()]
+        return "🛡 Raid mode: " + ", ".join(parts) + "."
+
+    async def _flush_summary(self, bot, chat_id, st):
+        # first notice goes out right away, later ones are batched per window
+        shown = None
+        while True:
+            if st.summary is not None:
+                await asyncio.sleep(self.window)
+            text = self._summary_text(st)
+            if text == shown:
+                return
+            try:
+                if st.summary is None:
+                    st.summary = await bot.send_message(chat_id, text)
+                else:
+                    await st.summary.edit_text(text)
+            except Exception:
+                log.debug("raid summary update failed in %s", chat_id, exc_info=True)
+                return
+            shown = text
@@ -0,0 +1,72 @@
+# packs.py
+# Per-user registry of the sticker packs /kang builds: which packs exist and
+# how many stickers each holds, so kang calls addStickerToSet or
+# createNewStickerSet right away and starts a new pack before the old one
+# is full. Counts are corrected from Telegram's answer whenever they drift.
+
+import re
+
+from cache import LRUCache
+
+# Telegram's cap for a regular static pack
+PACK_LIMIT = 120
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_]")
+
+
+def pack_name(user_id, index, bot_username):
+    """user_<id>[_<n>]_by_<bot>, at most 64 characters; the suffix is kept intact."""
+    base = f"user_{user_id}" if index == 0 else f"user_{user_id}_{index + 1}"
+    suffix = "_by_" + _UNSAFE.sub("_", bot_username or "bot")
+    return _UNSAFE.sub("_", base)[:64 - len(suffix)] + suffix
+
+
+def pack_title(first_name, index):
+    title = f"{first_name}'s stickers" if index == 0 else f"{first_name}'s stickers {index + 1}"
+    return title[:64]
+
+
+class PackRegistry:
+    def __init__(self, storage, limit=PACK_LIMIT, max_users=10000):
+        self.db = storage
+        self.limit = limit
+        self._packs = LRUCache(max_users)  # user_id -> {index: count}
+
+    @staticmethod
+    def init(con):
+        con.execute("CREATE TABLE IF NOT EXISTS sticker_packs (user_id INTEGER, idx INTEGER, name TEXT, "
+                    "count INTEGER, PRIMARY KEY(user_id, idx))")
+
+    async def _load(self, user_id):
+        packs = self._packs.get(user_id)
+        if packs is None:
+            rows = await self.db.fetchall("SELECT idx, count FROM sticker_packs WHERE user_id=?", (user_id,))
+            packs = dict(rows)
+            self._packs.put(user_id, packs)
+        return packs
+
+    async def target(self, user_id):
+        """(index, count) of the pack the next sticker goes into; count None = create it."""
+        packs = await self._load(user_id)
+        if not packs:
+            return 0, None
+        idx = max(packs)
+        if packs[idx] < self.limit:
+            return idx, packs[idx]
+        return idx + 1, None
+
+    async def record(self, user_id, idx, name, count):
+        await self.db.execute("INSERT INTO sticker_packs VALUES (?,?,?,?) ON CONFLICT(user_id, idx) "
+                              "DO UPDATE SET name=excluded.name, count=excluded.count", (user_id, idx, name, count))
+        packs = self._packs.peek(user_id)
+        if packs is not None:
+            packs[idx] = count
+
+    async def forget(self, user_id, idx):
+        await self.db.execute("DELETE FROM sticker_packs WHERE user_id=? AND idx=?", (user_id, idx))
+        packs = self._packs.peek(user_id)
+        if packs is not None:
+            packs.pop(idx, None)
+
+    def __len__(self):
+        return len(self._packs)
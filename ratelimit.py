@@ -0,0 +1,179 @@
+# ratelimit.py
+# Outbound Bot API scheduler, plugged into ApplicationBuilder.rate_limiter().
+#
+# Every request passes a global token bucket (Telegram allows ~30 req/s per
+# bot); messages sent into a chat also pass that chat's bucket (~1/s in
+# private chats, ~20/min in groups). Requests wait in a priority queue, so
+# moderation calls go out ahead of chat noise, and RetryAfter is honoured
+# by pausing and retrying instead of surfacing as an error.
+
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+# priorities, lower is served first
+MODERATION, NORMAL, COSMETIC = 0, 1, 2
+
+MODERATION_ENDPOINTS = frozenset((
+    "restrictChatMember", "banChatMember", "unbanChatMember", "deleteMessage", "deleteMessages",
+    "banChatSenderChat", "setChatPermissions", "getChatAdministrators", "getChatMember",
+))
+# endpoints that put a message into a chat and count against its send limit
+_CHAT_SEND_PREFIXES = ("send", "copyMessage", "forwardMessage", "editMessage")
+
+
+def classify(endpoint):
+    if endpoint in MODERATION_ENDPOINTS:
+        return MODERATION
+    if endpoint.startswith(_CHAT_SEND_PREFIXES):
+        return COSMETIC
+    return NORMAL
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    def __init__(self, overall_rate=30.0, overall_burst=30, private_rate=1.0, group_per_minute=20,
+                 max_retries=3, max_chats=20000):
+        self.overall = TokenBucket(overall_rate, overall_burst)
+        self.private_rate = private_rate
+        self.group_rate = group_per_minute / 60.0
+        self.max_retries = max_retries
+        self._chat_buckets = LRUCache(max_chats)  # chat_id -> (TokenBucket, asyncio.Lock)
+        self._paused_until = 0.0                  # global pause after a RetryAfter
+        self._heap = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self._chat_waiting = 0
+        self.observers = []  # fn(endpoint, data, result) called after each successful call
+        self.timers = []     # fn(endpoint, seconds, ok) for every attempt, excluding queueing
+        self.stats = {"requests": 0, "retry_after": 0, "by_priority": [0, 0, 0]}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+
+    # -- metrics --
+    def depth(self):
+        return len(self._heap) + self._chat_waiting
+
+    # -- scheduling --
+    def _chat_bucket(self, chat_id):
+        entry = self._chat_buckets.peek(chat_id)
+        if entry is None:
+            private = isinstance(chat_id, int) and chat_id > 0
+            rate = self.private_rate if private else self.group_rate
+            entry = (TokenBucket(rate, 1 if private else 3), asyncio.Lock())
+            self._chat_buckets.put(chat_id, entry)
+        return entry
+
+    async def _chat_slot(self, chat_id):
+        bucket, lock = self._chat_bucket(chat_id)
+        self._chat_waiting += 1
+        try:
+            async with lock:
+                while True:
+                    wait = bucket.wait_time(time.monotonic())
+                    if wait <= 0: break
+                    await asyncio.sleep(wait)
+                bucket.take(time.monotonic())
+        finally:
+            self._chat_waiting -= 1
+
+    async def _global_slot(self, priority):
+        now = time.monotonic()
+        if not self._heap and now >= self._paused_until and self.overall.wait_time(now) <= 0:
+            self.overall.take(now)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await fut
+
+    async def _dispatch(self):
+        while self._heap:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self.overall.wait_time(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, fut = heapq.heappop(self._heap)
+            if fut.done():
+                continue
+            self.overall.take(now)
+            fut.set_result(None)
+
+    def _timed(self, endpoint, t0, ok):
+        if self.timers:
+            elapsed = time.perf_counter() - t0
+            for fn in self.timers:
+                fn(endpoint, elapsed, ok)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = classify(endpoint)
+        chat_id = data.get("chat_id") if data else None
+        retries = rate_limit_args if isinstance(rate_limit_args, int) else self.max_retries
+        self.stats["requests"] += 1
+        self.stats["by_priority"][priority] += 1
+        for attempt in range(retries + 1):
+            if chat_id is not None and priority == COSMETIC:
+                await self._chat_slot(chat_id)
+            await self._global_slot(priority)
+            t0 = time.perf_counter()
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._timed(endpoint, t0, False)
+                self.stats["retry_after"] += 1
+                if attempt >= retries:
+                    raise
+                ra = e.retry_after
+                delay = (ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)) + 0.1
+                log.warning("Flood wait on %s (chat %s): retrying in %.1fs", endpoint, chat_id, delay)
+                if chat_id is not None and priority == COSMETIC:
+                    bucket, _ = self._chat_bucket(chat_id)
+                    bucket.tokens = min(bucket.tokens, 1 - delay * bucket.rate)
+                else:
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                continue
+            except Exception:
+                self._timed(endpoint, t0, False)
+                raise
+            self._timed(endpoint, t0, True)
+            for fn in self.observers:
+                try: fn(endpoint, data, result)
+                except Exception: pass
+            return result
@@ -0,0 +1,71 @@
+# roster.py
+# /all support: member rows (most recently seen first) are turned into
+# Markdown mention messages bounded by length and mention count, and the
+# finished pages are cached per chat until someone new shows up, a member
+# is pruned, or the TTL runs out.
+
+import time
+
+from cache import LRUCache
+
+# characters that would break a legacy-Markdown link label
+_UNSAFE = str.maketrans("", "", "[]`*_")
+
+
+def mention(user_id, name):
+    label = (name or "user").translate(_UNSAFE).strip()[:50] or "user"
+    return f"[{label}](tg://user?id={user_id})"
+
+
+def chunk_mentions(rows, max_len=3800, max_mentions=50):
+    """Pack (user_id, name, ...) rows into message texts; returns (pages, user_ids)."""
+    pages, ids = [], set()
+    cur, n = "", 0
+    for row in rows:
+        m = mention(row[0], row[1])
+        ids.add(row[0])
+        if cur and (len(cur) + 1 + len(m) > max_len or n >= max_mentions):
+            pages.append(cur)
+            cur, n = "", 0
+        cur = f"{cur} {m}" if cur else m
+        n += 1
+    if cur:
+        pages.append(cur)
+    return pages, ids
+
+
+class MentionPages:
+    def __init__(self, ttl=600.0, max_chats=1000, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._pages = LRUCache(max_chats)  # chat_id -> (expires, pages, user_ids)
+        self.stats = {"built": 0, "invalidated": 0}
+
+    def get(self, chat_id):
+        entry = self._pages.get(chat_id)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            self._pages.pop(chat_id)
+            return None
+        return entry[1]
+
+    def put(self, chat_id, pages, user_ids):
+        self._pages.put(chat_id, (self.clock() + self.ttl, pages, user_ids))
+        self.stats["built"] += 1
+
+    def seen(self, chat_id, user_id):
+        # called for every message, so only a dict peek and a set lookup
+        entry = self._pages.peek(chat_id)
+        if entry is not None and user_id not in entry[2]:
+            self.invalidate(chat_id)
+
+    def invalidate(self, chat_id=None):
+        if chat_id is None:
+            self._pages.clear()
+        elif self._pages.pop(chat_id) is None:
+            return
+        self.stats["invalidated"] += 1
+
+    def __len__(self):
+        return len(self._pages)
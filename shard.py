@@ -0,0 +1,115 @@
+# shard.py
+# Chat-ID sharding across worker processes. Every update is owned by the
+# worker hash(chat) % count, so a chat's updates are always processed by the
+# same process, in order, against that process's caches and flood state.
+# Webhook requests that land on another worker are forwarded to the owner's
+# internal listener (loopback by default, or SHARD_PEERS for several hosts).
+
+import time
+import errno
+import socket
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# update fields whose payload carries the chat (message-like) or only a user
+_CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member",
+                "chat_member", "chat_join_request", "message_reaction", "message_reaction_count", "chat_boost",
+                "removed_chat_boost")
+_USER_FIELDS = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer")
+
+
+def route_key(data):
+    """Chat id (or user id for chat-less updates) of a raw update dict."""
+    for f in _CHAT_FIELDS:
+        body = data.get(f)
+        if body:
+            return body.get("chat", {}).get("id", 0)
+    cq = data.get("callback_query")
+    if cq:
+        msg = cq.get("message")
+        return msg["chat"]["id"] if msg else cq.get("from", {}).get("id", 0)
+    for f in _USER_FIELDS:
+        body = data.get(f)
+        if body:
+            return (body.get("from") or body.get("user") or {}).get("id", 0)
+    return data.get("update_id", 0)
+
+
+class ShardRouter:
+    FORWARD_HEADER = "X-Bot-Shard-Forwarded"
+
+    def __init__(self, index=0, count=1, peers=(), timeout=5.0):
+        self.index = index
+        self.count = max(1, count)
+        self.peers = list(peers)  # base URL of each shard's internal listener, by index
+        self.timeout = timeout
+        self._session = None
+        self._lock = threading.Lock()
+        self.stats = {"forwarded": 0, "forward_errors": 0}
+
+    @property
+    def enabled(self):
+        return self.count > 1
+
+    def owner(self, data):
+        # chat ids are ints; % keeps negative group ids in range
+        return route_key(data) % self.count
+
+    def forward(self, owner, body):
+        """POST the raw update body to its owner; True once the owner accepted it."""
+        import requests
+        with self._lock:
+            if self._session is None:
+                self._session = requests.Session()
+        try:
+            resp = self._session.post(self.peers[owner] + "/", data=body, timeout=self.timeout,
+                                      headers={"Content-Type": "application/json", self.FORWARD_HEADER: str(self.index)})
+        except Exception as e:
+            self.stats["forward_errors"] += 1
+            log.warning("Forward to shard %s failed: %s", owner, e)
+            return False
+        if not resp.ok:
+            self.stats["forward_errors"] += 1
+            return False
+        self.stats["forwarded"] += 1
+        return True
+
+    def serve(self, app, host, port, wait=30.0):
+        """Run the WSGI app on the internal listener in a daemon thread.
+
+        After a reload the worker being replaced holds the port until gunicorn
+        stops it, so the bind is retried for up to `wait` seconds.
+        """
+        from werkzeug.serving import make_server
+
+        def run():
+            try:
+                sock = _listen(host, port, wait)
+            except OSError as e:
+                log.error("Shard %s cannot listen on %s:%s: %s", self.index, host, port, e)
+                return
+            server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+            sock.close()  # werkzeug works on its own dup of the descriptor
+            log.info("Shard %s/%s listening on %s:%s", self.index, self.count, host, port)
+            server.serve_forever()
+
+        threading.Thread(target=run, name=f"shard-{self.index}", daemon=True).start()
+
+
+def _listen(host, port, wait):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    deadline = time.monotonic() + wait
+    while True:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+            sock.listen(128)
+            return sock
+        except OSError as e:
+            sock.close()
+            if e.errno != errno.EADDRINUSE or time.monotonic() >= deadline:
+                raise
+        time.sleep(0.25)
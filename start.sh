@@ -4,5 +4,6 @@ export PYTHONUNBUFFERED=1
 export PYTHONPATH=.
 pip install --upgrade pip
 pip install -r requirements.txt
-# bind via gunicorn; Render provides $PORT
-gunicorn --workers 1 --bind 0.0.0.0:$PORT advanced_bot_full:app
+# bind via gunicorn; Render provides $PORT. WEB_CONCURRENCY workers each own a shard of
+# chats (see gunicorn.conf.py / shard.py)
+gunicorn -c gunicorn.conf.py advanced_bot_full:app
@@ -0,0 +1,166 @@
+# state.py
+# Pluggable backend for small pieces of live state that can outlive one
+# process: sliding-window counters (flood control), values with a TTL, and
+# set-once dedup markers.
+#
+#   memory://            in-process (default)
+#   sqlite:///path.db    a WAL SQLite file shared by every process on the host,
+#                        standing in for a network store such as Redis; flood
+#                        windows and dedup markers survive worker restarts
+#
+# Only this state is shared. Settings, notes, filters and admin caches stay
+# per process, so several workers still need chat sharding (shard.py).
+#
+# Every backend exposes the same async API so callers don't care which one
+# is configured; `shared` tells them whether other processes see the writes.
+
+import time
+import asyncio
+import logging
+
+from cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+
+def _sliding(cur, prev, now, window):
+    # two fixed buckets blended by how far we are into the current one
+    return cur + prev * (1.0 - (now % window) / window)
+
+
+class MemoryState:
+    shared = False
+
+    def __init__(self, max_keys=200000):
+        self._kv = LRUCache(max_keys)       # key -> (value, expires or None)
+        self._windows = LRUCache(max_keys)  # key -> [bucket, cur, prev]
+
+    async def incr_window(self, key, window, now=None):
+        """Count one hit for key; returns the (approximate) hits in the last `window` seconds."""
+        now = time.time() if now is None else now
+        bucket = int(now // window)
+        w = self._windows.get(key)
+        if w is None:
+            w = [bucket, 0, 0]
+            self._windows.put(key, w)
+        if w[0] != bucket:
+            w[2] = w[1] if w[0] == bucket - 1 else 0
+            w[0], w[1] = bucket, 0
+        w[1] += 1
+        return _sliding(w[1], w[2], now, window)
+
+    async def reset_window(self, key):
+        self._windows.pop(key)
+
+    async def get(self, key, default=None):
+        entry = self._kv.get(key)
+        if entry is None:
+            return default
+        value, expires = entry
+        if expires is not None and expires <= time.time():
+            self._kv.pop(key)
+            return default
+        return value
+
+    async def set(self, key, value, ttl=None):
+        self._kv.put(key, (value, time.time() + ttl if ttl else None))
+
+    async def delete(self, key):
+        self._kv.pop(key)
+
+    async def mark(self, key, ttl):
+        """Set a dedup marker; True if it was not already present (and unexpired)."""
+        now = time.time()
+        entry = self._kv.peek(key)
+        if entry is not None and (entry[1] is None or entry[1] > now):
+            return False
+        self._kv.put(key, (1, now + ttl))
+        return True
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        dead = [k for k, (_, exp) in self._kv.items() if exp is not None and exp <= now]
+        for k in dead:
+            self._kv.pop(k)
+        return len(dead)
+
+    async def run_sweeper(self, interval=60.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    def close(self):
+        pass
+
+
+class SQLiteState:
+    shared = True
+
+    def __init__(self, path, workers=2):
+        from storage import Storage
+        self.db = Storage(path, workers=workers)
+        self.db.call_sync(self._init)
+
+    @staticmethod
+    def _init(con):
+        con.execute("CREATE TABLE IF NOT EXISTS state_kv (key TEXT PRIMARY KEY, value, expires REAL)")
+        con.execute("CREATE TABLE IF NOT EXISTS state_windows (key TEXT PRIMARY KEY, bucket INTEGER, cur INTEGER, prev INTEGER, "
+                    "expires REAL)")
+        con.execute("CREATE INDEX IF NOT EXISTS state_windows_expires ON state_windows (expires)")
+
+    async def incr_window(self, key, window, now=None):
+        now = time.time() if now is None else now
+        bucket = int(now // window)
+        # one statement, so concurrent processes never lose an increment; a row
+        # stops mattering once the bucket after its current one has ended
+        row = await self.db.fetchone(
+            "INSERT INTO state_windows VALUES (?,?,1,0,?) ON CONFLICT(key) DO UPDATE SET "
+            "prev = CASE WHEN excluded.bucket = bucket THEN prev WHEN excluded.bucket = bucket + 1 THEN cur ELSE 0 END, "
+            "cur = CASE WHEN excluded.bucket = bucket THEN cur + 1 ELSE 1 END, "
+            "bucket = excluded.bucket, expires = excluded.expires RETURNING cur, prev",
+            (key, bucket, (bucket + 2) * window))
+        return _sliding(row[0], row[1], now, window)
+
+    async def reset_window(self, key):
+        await self.db.execute("DELETE FROM state_windows WHERE key=?", (key,))
+
+    async def get(self, key, default=None):
+        row = await self.db.fetchone("SELECT value FROM state_kv WHERE key=? AND (expires IS NULL OR expires > ?)",
+                                     (key, time.time()))
+        return row[0] if row else default
+
+    async def set(self, key, value, ttl=None):
+        await self.db.execute("INSERT OR REPLACE INTO state_kv VALUES (?,?,?)",
+                              (key, value, time.time() + ttl if ttl else None))
+
+    async def delete(self, key):
+        await self.db.execute("DELETE FROM state_kv WHERE key=?", (key,))
+
+    async def mark(self, key, ttl):
+        now = time.time()
+        changed = await self.db.execute(
+            "INSERT INTO state_kv VALUES (?,1,?) ON CONFLICT(key) DO UPDATE SET value=1, expires=excluded.expires "
+            "WHERE expires IS NOT NULL AND expires <= ?", (key, now + ttl, now))
+        return changed == 1
+
+    async def run_sweeper(self, interval=60.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                now = time.time()
+                await self.db.execute("DELETE FROM state_kv WHERE expires IS NOT NULL AND expires <= ?", (now,))
+                # rows from before the migration have no expiry; they are dropped too
+                await self.db.execute("DELETE FROM state_windows WHERE expires IS NULL OR expires <= ?", (now,))
+            except Exception:
+                log.exception("State sweep failed.")
+
+    def close(self):
+        self.db.close()
+
+
+def open_state(url):
+    if not url or url == "memory://":
+        return MemoryState()
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///"):])
+    raise ValueError(f"unsupported STATE_URL: {url}")
@@ -0,0 +1,191 @@
+# sticker_cache.py
+# Two-tier cache for /q and /kang output: encoded WEBP bytes in a memory LRU
+# backed by a size-capped directory, plus the Telegram file_id of the first
+# send so repeats can be resent without uploading anything.
+
+import os
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from cache import LRUCache, SizedLRU
+
+# part of every cache key, so stickers are re-rendered after an output change.
+# Lives here rather than in imaging.py so keys can be built without Pillow.
+RENDER_VERSION = 4  # bump whenever imaging.py output for the same input changes
+# encoder profiles tuned in imaging.PROFILES; unknown names encode as "balanced"
+PROFILE_NAMES = ("speed", "balanced", "size")
+
+
+class BlobStore:
+    """Directory of key-named files, capped at max_bytes with LRU eviction.
+
+    Every gunicorn worker writes into the same directory, so the index is
+    re-read from disk (at most every `rescan` seconds, before a write) and
+    max_bytes bounds the directory as a whole, not each worker's share.
+    Recency is the file mtime, which get() refreshes.
+    """
+
+    def __init__(self, root, max_bytes, suffix=".webp", rescan=60.0):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.rescan = rescan
+        self._index = None  # key -> size, least recently used first
+        self._scanned = 0.0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _path(self, key):
+        return self.root / f"{key}{self.suffix}"
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for e in os.scandir(self.root):
+            if e.is_file() and e.name.endswith(self.suffix):
+                st = e.stat()
+                entries.append((st.st_mtime, e.name[:-len(self.suffix)], st.st_size))
+        entries.sort()
+        self._index = OrderedDict((k, size) for _, k, size in entries)
+        self._bytes = sum(self._index.values())
+        self._scanned = time.monotonic()
+
+    def get(self, key):
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._bytes -= self._index.pop(key, 0)
+            return None
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        with self._lock:
+            if self._index is not None and time.monotonic() - self._scanned >= self.rescan:
+                self._index = None  # count what the other workers wrote since
+            self._load_index()
+        # unique temp name: threads and workers may write the same key at once
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            try: os.unlink(tmp)
+            except OSError: pass
+            if not path.exists():
+                raise
+            # another writer got there first; same key, same bytes
+        with self._lock:
+            self._bytes += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._evict()
+        return path
+
+    def put_content(self, data):
+        """Store data under its content hash; identical data is kept once. Returns the key."""
+        key = hashlib.sha256(data).hexdigest()[:40]
+        with self._lock:
+            self._load_index()
+            known = key in self._index
+            if known:
+                self._index.move_to_end(key)
+        if known:
+            try:
+                os.utime(self._path(key))
+                return key
+            except OSError:
+                pass  # evicted or removed meanwhile; write it again
+        self.put(key, data)
+        return key
+
+    def __contains__(self, key):
+        with self._lock:
+            self._load_index()
+            return key in self._index
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try: self._path(key).unlink()
+            except OSError: pass
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._index or ()), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+
+class StickerCache:
+    def __init__(self, root, mem_bytes=32 * 2**20, disk_bytes=256 * 2**20, file_ids=20000):
+        self.mem = SizedLRU(mem_bytes)
+        self.disk = BlobStore(root, disk_bytes)
+        self.file_ids = LRUCache(file_ids)
+        self.hits = {"file_id": 0, "memory": 0, "disk": 0}
+        self.misses = 0
+
+    @staticmethod
+    def key_for_file(file_unique_id, version, profile):
+        return f"f{version}-{profile}-{file_unique_id}"
+
+    @staticmethod
+    def key_for_text(text, version, profile):
+        return f"t{version}-{profile}-" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:40]
+
+    def file_id(self, key):
+        fid = self.file_ids.get(key)
+        if fid is not None:
+            self.hits["file_id"] += 1
+        return fid
+
+    def set_file_id(self, key, file_id):
+        if file_id:
+            self.file_ids.put(key, file_id)
+
+    def forget_file_id(self, key):
+        self.file_ids.pop(key)
+
+    async def get(self, key):
+        data = self.mem.get(key)
+        if data is not None:
+            self.hits["memory"] += 1
+            return data
+        data = await asyncio.to_thread(self.disk.get, key)
+        if data is not None:
+            self.hits["disk"] += 1
+            self.mem.put(key, data)
+            return data
+        self.misses += 1
+        return None
+
+    async def put(self, key, data):
+        self.mem.put(key, data)
+        try:
+            await asyncio.to_thread(self.disk.put, key, data)
+        except OSError:
+            pass
+
+    def stats(self):
+        hits = sum(self.hits.values())
+        total = hits + self.misses
+        return {"hits": dict(self.hits), "misses": self.misses,
+                "hit_rate": (hits / total) if total else 0.0,
+                "memory": self.mem.stats(), "disk": self.disk.stats(), "file_ids": len(self.file_ids)}
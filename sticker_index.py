@@ -0,0 +1,44 @@
+# sticker_index.py
+# In-memory index of banned stickers, answering sticker_auto without I/O.
+#
+# Bans are (chat_id, kind, value) triples: kind is "file" (file_unique_id) or
+# "set" (sticker set name), and chat_id GLOBAL applies to every chat.
+
+GLOBAL = 0
+
+
+class StickerIndex:
+    def __init__(self):
+        self._bans = set()
+        self.checks = 0
+        self.blocked = 0
+
+    def load(self, rows):
+        self._bans = {(chat_id or GLOBAL, kind, value) for chat_id, kind, value in rows}
+
+    def add(self, chat_id, kind, value):
+        self._bans.add((chat_id or GLOBAL, kind, value))
+
+    def remove(self, chat_id, kind, value):
+        self._bans.discard((chat_id or GLOBAL, kind, value))
+
+    def is_banned(self, chat_id, file_unique_id, set_name=None):
+        self.checks += 1
+        bans = self._bans
+        hit = ((GLOBAL, "file", file_unique_id) in bans
+               or (chat_id, "file", file_unique_id) in bans
+               or (set_name is not None
+                   and ((GLOBAL, "set", set_name) in bans or (chat_id, "set", set_name) in bans)))
+        if hit:
+            self.blocked += 1
+        return hit
+
+    def entries(self, chat_id=None):
+        """Bans visible in chat_id (global ones first), as (scope, kind, value)."""
+        out = sorted(("global", k, v) for c, k, v in self._bans if c == GLOBAL)
+        if chat_id is not None and chat_id != GLOBAL:
+            out += sorted(("chat", k, v) for c, k, v in self._bans if c == chat_id)
+        return out
+
+    def __len__(self):
+        return len(self._bans)
@@ -0,0 +1,200 @@
+# storage.py
+# Pooled SQLite access for the bot: one persistent WAL-mode connection per
+# executor thread, cached prepared statements, and async wrappers so that
+# queries never run on the asyncio event loop.
+
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, lru_cache
+
+
+@lru_cache(maxsize=512)
+def sql_label(sql):
+    """Short label for timing: statement verb plus the table it touches."""
+    words = sql.split()
+    verb = words[0].upper() if words else "?"
+    for kw in ("FROM", "INTO", "UPDATE", "TABLE"):
+        for i, w in enumerate(words[:-1]):
+            if w.upper() == kw:
+                return f"{verb} {words[i + 1].split('(')[0]}"
+    return verb
+
+
+class Storage:
+    def __init__(self, path, workers=2, cached_statements=256, busy_timeout=5.0):
+        self.path = str(path)
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sqlite")
+        self.timers = []  # fn(label, seconds) called after each async call, on the loop
+
+    # -- connections --
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use."""
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                  cached_statements=self.cached_statements,
+                                  check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA temp_store=MEMORY")
+            self._local.con = con
+            with self._lock:
+                self._conns.append(con)
+        return con
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for con in self._conns:
+                try: con.close()
+                except Exception: pass
+            self._conns.clear()
+        self._local = threading.local()
+
+    # -- sync API (runs in the calling thread, one transaction per call) --
+    def call_sync(self, fn, *args):
+        con = self.connection()
+        with con:
+            return fn(con, *args)
+
+    def execute_sync(self, sql, params=()):
+        return self.call_sync(lambda con: con.execute(sql, params).rowcount)
+
+    def executemany_sync(self, sql, rows):
+        return self.call_sync(lambda con: con.executemany(sql, rows).rowcount)
+
+    def fetchone_sync(self, sql, params=()):
+        return self.call_sync(lambda con: con.execute(sql, params).fetchone())
+
+    def fetchall_sync(self, sql, params=()):
+        return self.call_sync(lambda con: con.execute(sql, params).fetchall())
+
+    # -- async API (runs on the dedicated executor) --
+    def submit(self, fn, *args):
+        """Schedule fn(con, *args) on the executor; returns a concurrent Future."""
+        return self._executor.submit(self.call_sync, fn, *args)
+
+    async def call(self, fn, *args):
+        return await self._run(getattr(fn, "__name__", "call"), fn, *args)
+
+    async def _run(self, label, fn, *args):
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, partial(self.call_sync, fn, *args))
+        finally:
+            if self.timers:
+                elapsed = time.perf_counter() - t0
+                for t in self.timers:
+                    t(label, elapsed)
+
+    async def execute(self, sql, params=()):
+        return await self._run(sql_label(sql), lambda con: con.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, rows):
+        return await self._run(sql_label(sql), lambda con: con.executemany(sql, rows).rowcount)
+
+    async def fetchone(self, sql, params=()):
+        return await self._run(sql_label(sql), lambda con: con.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self._run(sql_label(sql), lambda con: con.execute(sql, params).fetchall())
+
+
+class WriteBehind:
+    """Coalescing write-behind buffer for idempotent upserts.
+
+    Rows are keyed; a row identical to one recently written is dropped, and
+    pending rows are flushed with one executemany() transaction when the
+    buffer reaches max_pending, every `interval` seconds, or on close().
+    """
+
+    def __init__(self, storage, sql, max_pending=500, interval=1.0, recent_size=20000):
+        self.storage = storage
+        self.sql = sql
+        self.max_pending = max_pending
+        self.interval = interval
+        self.recent_size = recent_size
+        self._pending = {}
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # a single writer thread keeps successive batches in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-behind")
+        self.stats = {"added": 0, "skipped": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+
+    def add(self, key, row):
+        with self._lock:
+            if self._recent.get(key) == row:
+                self._recent.move_to_end(key)
+                self.stats["skipped"] += 1
+                return
+            self._pending[key] = row
+            self._recent[key] = row
+            self._recent.move_to_end(key)
+            if len(self._recent) > self.recent_size:
+                self._recent.popitem(last=False)
+            self.stats["added"] += 1
+            full = len(self._pending) >= self.max_pending
+        if self._thread is None:
+            self.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Submit pending rows; returns the storage Future or None if idle."""
+        with self._lock:
+            if not self._pending:
+                return None
+            batch, self._pending = self._pending, {}
+        rows = list(batch.values())
+        fut = self._writer.submit(self.storage.call_sync, lambda con: con.executemany(self.sql, rows).rowcount)
+        fut.add_done_callback(lambda f: self._flushed(f, batch))
+        return fut
+
+    async def aflush(self):
+        fut = self.flush()
+        if fut is not None:
+            await asyncio.wrap_future(fut)
+
+    def _flushed(self, fut, batch):
+        with self._lock:
+            if fut.exception() is None:
+                self.stats["flushes"] += 1
+                self.stats["rows_written"] += len(batch)
+                return
+            # forget the rows so the next sighting retries the write
+            self.stats["errors"] += 1
+            for key, row in batch.items():
+                if self._recent.get(key) == row:
+                    del self._recent[key]
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try: self.flush()
+            except Exception: pass
+
+    def close(self):
+        self._stop.set()
+        fut = self.flush()
+        if fut is not None:
+            try: fut.result()
+            except Exception: pass
+        self._writer.shutdown(wait=True)
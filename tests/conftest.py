@@ -0,0 +1,7 @@
+# tests/conftest.py
+# The bot's modules live flat at the repository root.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,44 @@
+import asyncio
+
+from flood import FloodControl
+
+
+def test_flags_limit_th_message_in_window():
+    fc = FloodControl(limit=3, window=6.0)
+    assert [fc.hit(1, 7, t) for t in (0, 1, 2)] == [False, False, True]
+    assert fc.hit(1, 7, 20) is False
+
+
+def test_sweep_keeps_rings_inside_chat_window():
+    # /flood 3 60 on a bot whose default window is 6s
+    fc = FloodControl(limit=6, window=6.0)
+    out = []
+    for t in (0, 10, 20):
+        out.append(fc.hit(1, 7, t, limit=3, window=60))
+        fc.sweep(t + 9)
+    assert out == [False, False, True]
+
+
+def test_sweep_drops_idle_users_and_chats():
+    fc = FloodControl(limit=3, window=6.0)
+    fc.hit(1, 7, 0)
+    fc.hit(2, 8, 0, window=60)
+    assert fc.sweep(10) == 1
+    assert fc.tracked() == 1
+    assert fc.sweep(61) == 1
+    assert fc.stats()["chats"] == 0 and not fc._windows
+
+
+def test_run_sweeper_uses_chat_window():
+    fc = FloodControl(limit=6, window=6.0)
+    clock = [0.0]
+    fc.hit(1, 7, 0, limit=3, window=60)
+
+    async def run():
+        task = asyncio.create_task(fc.run_sweeper(lambda: clock[0], interval=0))
+        clock[0] = 30.0
+        await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(run())
+    assert fc.tracked() == 1
@@ -0,0 +1,29 @@
+import tracemalloc
+
+import note_index
+from note_index import NoteIndex
+
+
+def test_suggest_prefix_and_typo():
+    idx = NoteIndex()
+    idx.load(1, ["rules", "rules_long", "welcome"])
+    assert idx.suggest(1, "rul") == ["rules", "rules_long"]
+    assert idx.suggest(1, "welcme") == ["welcome"]
+
+
+def test_suggest_empty_chat_skips_work(monkeypatch):
+    idx = NoteIndex()
+    idx.load(1, [])
+    monkeypatch.setattr(note_index, "_edits1", lambda w: (_ for _ in ()).throw(AssertionError("expanded")))
+    assert idx.suggest(1, "x" * 4000) == []
+    assert idx.suggest(2, "rules") == []  # chat not indexed
+
+
+def test_suggest_long_key_is_bounded():
+    idx = NoteIndex()
+    idx.load(1, ["rules", "welcome", "k" * 60])
+    tracemalloc.start()
+    assert idx.suggest(1, "q" * 4000) == []
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 2**20
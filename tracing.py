@@ -0,0 +1,168 @@
+# tracing.py
+# Per-update span trees and an opt-in sampling profiler.
+#
+# UpdateTracer.trace() opens a root span for one update in a ContextVar; DB,
+# conversion and Bot API timings recorded while it is active become child
+# spans, and updates slower than the threshold are logged with their tree.
+# Outside a trace every call here is a ContextVar lookup and a return.
+
+import sys
+import time
+import logging
+import threading
+import contextlib
+from collections import Counter
+from contextvars import ContextVar
+
+log = logging.getLogger(__name__)
+
+_current = ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "children", "root")
+
+    def __init__(self, name, start, root=None):
+        self.name = name
+        self.start = start
+        self.end = None
+        self.children = []
+        self.root = root or self
+
+    def duration(self):
+        return ((self.end or time.perf_counter()) - self.start) * 1000.0
+
+
+class _Root(Span):
+    __slots__ = ("spans", "dropped")
+
+    def __init__(self, name, start, max_spans):
+        super().__init__(name, start)
+        self.spans = max_spans
+        self.dropped = 0
+
+    def admit(self):
+        if self.spans <= 0:
+            self.dropped += 1
+            return False
+        self.spans -= 1
+        return True
+
+
+@contextlib.contextmanager
+def span(name):
+    """Child span around a block; a no-op when no update is being traced."""
+    parent = _current.get()
+    if parent is None or not parent.root.admit():
+        yield
+        return
+    s = Span(name, time.perf_counter(), parent.root)
+    parent.children.append(s)
+    token = _current.set(s)
+    try:
+        yield
+    finally:
+        s.end = time.perf_counter()
+        _current.reset(token)
+
+
+def record(name, seconds):
+    """Attach an already finished operation (e.g. from a timers hook) to the current span."""
+    parent = _current.get()
+    if parent is None or not parent.root.admit():
+        return
+    end = time.perf_counter()
+    s = Span(name, end - seconds, parent.root)
+    s.end = end
+    parent.children.append(s)
+
+
+def format_tree(root):
+    lines = []
+
+    def walk(s, depth):
+        lines.append(f"{'  ' * depth}{s.name} {s.duration():.1f}ms")
+        for c in sorted(s.children, key=lambda c: c.start):
+            walk(c, depth + 1)
+
+    walk(root, 0)
+    if root.dropped:
+        lines.append(f"  ... {root.dropped} more spans not recorded")
+    return "\n".join(lines)
+
+
+class UpdateTracer:
+    def __init__(self, slow_ms=1000.0, max_spans=200):
+        self.slow_ms = slow_ms
+        self.max_spans = max_spans
+        self.stats = {"traced": 0, "slow": 0}
+
+    @contextlib.contextmanager
+    def trace(self, update):
+        root = _Root(f"update {getattr(update, 'update_id', '?')}", time.perf_counter(), self.max_spans)
+        token = _current.set(root)
+        try:
+            yield root
+        finally:
+            root.end = time.perf_counter()
+            _current.reset(token)
+            self.stats["traced"] += 1
+            if root.duration() >= self.slow_ms:
+                self.stats["slow"] += 1
+                log.warning("Slow update:\n%s", format_tree(root))
+
+
+class SamplingProfiler:
+    """Samples thread stacks every `interval` seconds into collapsed-stack counts
+    (the flamegraph.pl / speedscope input format). Costs nothing until started."""
+
+    def __init__(self, interval=0.005, path="profile.folded"):
+        self.interval = interval
+        self.path = path
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.samples = Counter()  # each session writes only its own stacks
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write the collapsed stacks; returns the file path."""
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.dump()
+        return self.path
+
+    def dump(self):
+        with open(self.path, "w") as f:
+            for stack, n in self.samples.most_common():
+                f.write(f"{stack} {n}\n")
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for t in threading.enumerate():
+                names[t.ident] = t.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1